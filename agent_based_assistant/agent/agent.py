@@ -1,15 +1,19 @@
 # React Agent setup for visa assistant
 # Purpose: Create the main agent using LangGraph's create_react_agent with streaming support
 
-from typing import Any, Dict, List, AsyncGenerator
-from langchain_core.messages import AnyMessage, SystemMessage
+import asyncio
+import logging
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, AsyncGenerator, Optional, Union
+from langchain_core.messages import AnyMessage, AIMessage, HumanMessage
 from langgraph.prebuilt import create_react_agent
 from langgraph.graph import StateGraph
 from langgraph.prebuilt.chat_agent_executor import AgentState
 
-from agent.state import AgentState as VisaAgentState, validate_agent_state, create_error_record
-from agent.prompts import get_system_prompt
-from config.settings import llm, stream_llm_safe, app_config
+from agent.state import AgentState as VisaAgentState, validate_agent_state, create_error_record, compact_messages
+from agent.prompts import get_system_message, SUMMARIZATION_PROMPT
+from config.settings import llm, stream_llm_safe, invoke_llm_safe, app_config
 from tools.greetings import greetings_tool
 from tools.visa_information import general_enquiry_tool  
 from tools.application_basic import base_information_collector_tool
@@ -18,6 +22,100 @@ from tools.application_detailed import application_detailed_tool
 from tools.document_processing import document_processing_tool
 from tools.session_management import session_management_tool
 
+logger = logging.getLogger(__name__)
+
+# State schema field names accepted from input data
+STATE_KEYS = frozenset(VisaAgentState.__annotations__)
+
+
+class TokenEvent:
+    """Single streamed token from the agent node (slotted to keep per-token cost low)"""
+    __slots__ = ("token", "metadata")
+    type = "token"
+    
+    def __init__(self, token: str, metadata: Dict[str, Any]):
+        self.token = token
+        self.metadata = metadata
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Dict form for serialization boundaries"""
+        return {"token": self.token, "type": self.type, "metadata": self.metadata}
+
+
+# Tools available to the agent (built once at import)
+TOOLS = (
+    greetings_tool,
+    general_enquiry_tool,
+    base_information_collector_tool,
+    visa_type_analyzer_tool,
+    application_detailed_tool,
+    document_processing_tool,
+    session_management_tool
+)
+
+
+# Base state copied for every request by _prepare_state
+STATE_TEMPLATE: VisaAgentState = {"tool_call_count": 0, "state_version": 1}
+
+# User-facing error payloads
+ERROR_RESULT_BASE = {"error": True, "collection_status": "error"}
+AGENT_ERROR_RESPONSE = "I'm experiencing some technical difficulties. Let me try to help you in a different way. What can I assist you with regarding your visa needs?"
+STREAM_ERROR_RESPONSE = "I encountered an issue while processing your request. Please try again."
+
+# Agent result fields passed through to callers by _process_result
+RESULT_KEYS = ("messages", "session_id", "missing_fields", "conversation_context", "conversation_summary")
+
+# Graph nodes whose message chunks are streamed to the user
+AGENT_NODES = frozenset({"agent"})
+
+# Messages whose tool choice is unambiguous, answered without the LLM planner
+GREETING_PATTERN = re.compile(
+    r"(hi|hello|hey|hey there|good morning|good afternoon|good evening"
+    r"|thanks|thank you|bye|goodbye)[\s!.,]*"
+)
+
+
+@lru_cache(maxsize=4096)
+def _fast_intent(normalized_message: str) -> Optional[str]:
+    """Return the tool name for a trivially classifiable message, else None"""
+    if GREETING_PATTERN.fullmatch(normalized_message):
+        return greetings_tool.name
+    return None
+
+
+FAST_PATH_TOOLS = {greetings_tool.name: greetings_tool}
+
+
+def custom_prompt(state: VisaAgentState) -> List[AnyMessage]:
+    """
+    Generate system prompt based on current state context.
+    Provides agent with context-aware instructions.
+    """
+    # Cached system message followed by conversation history
+    return [get_system_message(state), *(state.get("messages") or ())]
+
+
+def summarize_messages(messages: List[AnyMessage], previous_summary: Optional[str]) -> str:
+    """Summarize older conversation turns for compaction"""
+    transcript = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    prompt = SUMMARIZATION_PROMPT.format(previous_summary=previous_summary or "None", transcript=transcript)
+    return invoke_llm_safe([HumanMessage(content=prompt)]).content.strip()
+
+
+def compact_history(state: VisaAgentState) -> Dict[str, Any]:
+    """
+    Pre-model hook: compact long histories before each LLM call.
+    llm_input_messages is always set so a previous step's value is never reused.
+    """
+    update = compact_messages(
+        state,
+        summarize_messages,
+        keep_last=app_config.compaction_keep_last,
+        token_budget=app_config.compaction_token_budget
+    )
+    kept_messages = update["messages"][1:] if "messages" in update else state["messages"]
+    return {**update, "llm_input_messages": kept_messages}
+
 
 class VisaAssistantAgent:
     """
@@ -25,117 +123,141 @@ class VisaAssistantAgent:
     Handles tool selection, state management, and streaming responses.
     """
     
-    def __init__(self):
-        self.tools = self._initialize_tools()
+    def __init__(self, checkpointer=None):
+        self.tools = TOOLS
+        self.checkpointer = checkpointer
         self.agent = self._create_agent()
-        
-    def _initialize_tools(self) -> List:
-        """Initialize all available tools for the agent"""
-        return [
-            greetings_tool,
-            general_enquiry_tool,
-            base_information_collector_tool,
-            visa_type_analyzer_tool,
-            application_detailed_tool,
-            document_processing_tool,
-            session_management_tool
-        ]
     
     def _create_agent(self):
-        """Create the React Agent with custom state and prompt"""
-        
-        def custom_prompt(state: VisaAgentState) -> List[AnyMessage]:
-            """
-            Generate system prompt based on current state context.
-            Provides agent with context-aware instructions.
-            """
-            # Validate state before processing
-            is_valid, issues = validate_agent_state(state)
-            if not is_valid:
-                print(f"State validation issues: {issues}")
-            
-            # Get base system prompt
-            system_prompt = get_system_prompt(state)
-            
-            # Add system message to conversation
-            messages = [SystemMessage(content=system_prompt)]
-            
-            # Add conversation history
-            if state.get("messages"):
-                messages.extend(state["messages"])
-            
-            return messages
-        
-        # Create React Agent with custom state schema
-        agent = create_react_agent(
+        """
+        Create the React Agent with custom state and prompt.
+        version="v2" dispatches each tool call through the Send API, so
+        independent tool calls from one response run in the same superstep.
+        """
+        return create_react_agent(
             model=llm,
             tools=self.tools,
             state_schema=VisaAgentState,
-            prompt=custom_prompt
+            prompt=custom_prompt,
+            pre_model_hook=compact_history,
+            version="v2",
+            checkpointer=self.checkpointer
         )
-        
-        return agent
     
-    def invoke(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    def invoke(self, input_data: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Synchronous wrapper around ainvoke for callers without an event loop.
+        Server code should await ainvoke directly.
+        """
+        return asyncio.run(self.ainvoke(input_data, config))
+    
+    async def ainvoke(self, input_data: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Invoke agent with state validation and error handling.
         Non-streaming version for simple interactions.
+        With a checkpointer, input_data only carries the new messages and
+        config must hold the thread_id whose history the reducer appends to.
         """
         try:
             # Prepare state with safety checks
             state = self._prepare_state(input_data)
             
-            # Invoke agent
-            result = self.agent.invoke(state)
+            # Answer trivially classifiable messages without the LLM planner
+            fast_response = self._fast_path_response(state)
+            if fast_response is not None:
+                ai_message = AIMessage(content=fast_response)
+                await self._record_fast_path(state, ai_message, config)
+                result = {**state, "messages": [*state["messages"], ai_message]}
+                return self._process_result(result)
+            
+            # Invoke agent without blocking the event loop
+            result = await self.agent.ainvoke(state, config)
             
             # Validate and clean result
             return self._process_result(result)
             
         except Exception as e:
-            print(f"Agent invocation error: {e}")
+            logger.exception("Agent invocation error")
             return self._handle_agent_error(input_data, str(e))
     
-    async def stream(self, input_data: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+    async def stream(self, input_data: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> AsyncGenerator[Union[TokenEvent, Dict[str, Any]], None]:
         """
         Stream agent responses for real-time UI updates.
-        Yields state updates as they occur.
+        Yields TokenEvent per token, or an error dict if streaming fails.
         """
         try:
             # Prepare state
             state = self._prepare_state(input_data)
             
-            # Stream with messages mode for token-level streaming (following LangGraph docs)
-            async for message_chunk, metadata in self.agent.astream(state, stream_mode="messages"):
-                processed_chunk = self._process_message_chunk(message_chunk, metadata)
-                if processed_chunk:
-                    yield processed_chunk
+            # Answer trivially classifiable messages without the LLM planner
+            fast_response = self._fast_path_response(state)
+            if fast_response is not None:
+                await self._record_fast_path(state, AIMessage(content=fast_response), config)
+                yield TokenEvent(fast_response, {"langgraph_node": "fast_path"})
+                return
+            
+            # Stream with messages mode for token-level streaming (following LangGraph docs).
+            # The agent only advances when the consumer asks for the next token, so a slow
+            # consumer applies backpressure without any extra buffer
+            async for message_chunk, metadata in self.agent.astream(state, config, stream_mode="messages"):
+                token_event = self._process_message_chunk(message_chunk, metadata)
+                if token_event:
+                    yield token_event
                     
         except Exception as e:
-            print(f"Agent streaming error: {e}")
+            logger.exception("Agent streaming error")
             yield self._handle_stream_error(input_data, str(e))
     
+    def _fast_path_response(self, state: VisaAgentState) -> Optional[str]:
+        """
+        Run the tool directly when the latest user message maps to a single tool
+        with certainty (see _fast_intent). Returns None when the agent must decide.
+        """
+        messages = state["messages"]
+        if not messages:
+            return None
+        
+        last_message = messages[-1]
+        content = getattr(last_message, 'content', None)
+        if getattr(last_message, 'type', None) != 'human' or type(content) is not str:
+            return None
+        
+        tool_name = _fast_intent(content.strip().lower())
+        if tool_name is None:
+            return None
+        
+        return FAST_PATH_TOOLS[tool_name].invoke({"user_message": content})
+    
+    async def _record_fast_path(self, state: VisaAgentState, ai_message: AIMessage, config: Optional[Dict[str, Any]]) -> None:
+        """Persist a fast-path exchange to the checkpointer so the thread history stays complete"""
+        if self.checkpointer is None or not config:
+            return
+        await self.agent.aupdate_state(
+            config,
+            {"messages": [state["messages"][-1], ai_message]},
+            as_node="agent"
+        )
+    
     def _prepare_state(self, input_data: Dict[str, Any]) -> VisaAgentState:
         """
         Prepare and validate state from input data.
         Ensures state consistency and adds required fields.
         """
         # Start with base state structure
-        state = VisaAgentState({
-            "messages": input_data.get("messages", []),
-            "tool_call_count": 0,
-            "state_version": 1
-        })
+        state = STATE_TEMPLATE.copy()
+        state["messages"] = input_data.get("messages", [])
         
         # Merge additional state fields if provided
         for key, value in input_data.items():
-            if key in VisaAgentState.__annotations__ and value is not None:
+            if value is not None and key in STATE_KEYS:
                 state[key] = value
         
-        # Validate prepared state
-        is_valid, issues = validate_agent_state(state)
-        if not is_valid:
-            print(f"State preparation issues: {issues}")
-            # Could implement auto-correction here
+        # Validate prepared state (debug only, kept off the request hot path)
+        if app_config.debug:
+            is_valid, issues = validate_agent_state(state)
+            if not is_valid:
+                logger.warning("State preparation issues: %s", issues)
+                # Could implement auto-correction here
         
         return state
     
@@ -144,115 +266,100 @@ class VisaAssistantAgent:
         Process and validate agent result.
         Ensures result contains required fields and clean data.
         """
-        # Extract key information for response
-        processed = {
-            "messages": result.get("messages", []),
-            "session_id": result.get("session_id"),
-            "collection_status": self._determine_collection_status(result),
-            "missing_fields": result.get("missing_fields"),
-            "conversation_context": result.get("conversation_context")
-        }
+        # Extract key information for response (only fields the agent actually returned)
+        processed = {key: result[key] for key in RESULT_KEYS if key in result}
+        processed["collection_status"] = self._determine_collection_status(result)
         
-        # Get latest assistant message for response
-        if processed["messages"]:
-            for msg in reversed(processed["messages"]):
-                if hasattr(msg, 'type') and msg.type == 'ai':
-                    processed["response"] = msg.content
-                    break
+        # missing_fields is a frozenset in state; the API exposes a stable list
+        if processed.get("missing_fields"):
+            processed["missing_fields"] = sorted(processed["missing_fields"])
+        
+        # Get latest assistant message for response (normally the final message)
+        messages = processed.get("messages")
+        if messages:
+            last_message = messages[-1]
+            if getattr(last_message, 'type', None) == 'ai':
+                processed["response"] = last_message.content
+            else:
+                for msg in reversed(messages):
+                    if getattr(msg, 'type', None) == 'ai':
+                        processed["response"] = msg.content
+                        break
         
         return processed
     
-    def _process_message_chunk(self, message_chunk, metadata) -> Dict[str, Any]:
+    def _process_message_chunk(self, message_chunk, metadata) -> Optional[TokenEvent]:
         """
         Process message chunks following LangGraph documentation pattern.
         Input: message_chunk (the token/message), metadata (graph info)
         """
-        # Process message chunks from agent node only (LangGraph official pattern)
-        # OLD WORKING CODE (COMMENTED OUT):
-        # # Check if this is an AI message with content (following LangGraph docs)
-        # if hasattr(message_chunk, 'content') and message_chunk.content:
-        #     # Only process non-empty string content
-        #     if isinstance(message_chunk.content, str) and message_chunk.content.strip():
-        #         return {
-        #             "token": message_chunk.content,
-        #             "type": "token",
-        #             "metadata": metadata
-        #         }
-        # 
-        # # Skip everything else (tool calls, empty content, etc.)
-        # return None
+        # Only process messages from 'agent' node, skip 'tools' node output (prevents duplication).
+        # Tool-internal LLM tokens are already excluded upstream via NOSTREAM_TAG.
+        if metadata['langgraph_node'] not in AGENT_NODES:
+            return None
         
-        # LANGRAPH OFFICIAL FILTERING - Use metadata to filter by node
-        # Only process messages from 'agent' node, skip 'tools' node (prevents duplication)
-        if metadata.get('langgraph_node') != 'agent':
-            return None  # Skip tool responses and other nodes
+        content = getattr(message_chunk, 'content', None)
+        if not content:
+            return None
         
-        # Process AI message content from agent node only
-        if hasattr(message_chunk, 'content') and message_chunk.content:
-            # Handle list format: [{'text': 'Hello!', 'type': 'text', 'index': 0}]
-            if isinstance(message_chunk.content, list) and len(message_chunk.content) > 0:
-                text_item = message_chunk.content[0]
-                if isinstance(text_item, dict) and text_item.get('type') == 'text':
-                    text_content = text_item.get('text', '')
-                    if text_content and text_content.strip():
-                        return {
-                            "token": text_content,
-                            "type": "token",
-                            "metadata": metadata
-                        }
-            # Handle string format (fallback)
-            elif isinstance(message_chunk.content, str) and message_chunk.content.strip():
-                return {
-                    "token": message_chunk.content,
-                    "type": "token",
-                    "metadata": metadata
-                }
+        content_type = type(content)
+        # Handle list format: [{'text': 'Hello!', 'type': 'text', 'index': 0}]
+        if content_type is list:
+            text_item = content[0]
+            if type(text_item) is dict and text_item.get('type') == 'text':
+                text_content = text_item.get('text')
+                if text_content and not text_content.isspace():
+                    return TokenEvent(text_content, metadata)
+        # Handle string format (fallback)
+        elif content_type is str and not content.isspace():
+            return TokenEvent(content, metadata)
         
         # Skip everything else (empty content, tool setup chunks, etc.)
         return None
     
     def _determine_collection_status(self, state: Dict[str, Any]) -> str:
         """Determine current collection status based on state"""
-        if not state.get("initial_info"):
+        get = state.get
+        if not get("initial_info"):
             return "not_started"
-        elif state.get("collection_in_progress"):
+        if get("collection_in_progress"):
             return "in_progress"
-        elif state.get("personal_info") and state.get("passport_info"):
+        if get("personal_info") and get("passport_info"):
             return "detailed_complete"
-        elif state.get("initial_info"):
-            return "basic_complete"
-        else:
-            return "incomplete"
+        return "basic_complete"
     
     def _handle_agent_error(self, input_data: Dict[str, Any], error_msg: str) -> Dict[str, Any]:
         """Handle agent errors gracefully with user-friendly responses"""
-        return {
-            "response": "I'm experiencing some technical difficulties. Let me try to help you in a different way. What can I assist you with regarding your visa needs?",
-            "error": True,
-            "error_message": error_msg,
-            "session_id": input_data.get("session_id"),
-            "collection_status": "error"
-        }
+        return self._build_error_result(input_data, error_msg, AGENT_ERROR_RESPONSE)
     
     def _handle_stream_error(self, input_data: Dict[str, Any], error_msg: str) -> Dict[str, Any]:
         """Handle streaming errors gracefully"""
+        error_result = self._build_error_result(input_data, error_msg, STREAM_ERROR_RESPONSE)
+        error_result["type"] = "error"
+        return error_result
+    
+    def _build_error_result(self, input_data: Dict[str, Any], error_msg: str, response: str) -> Dict[str, Any]:
+        """Shared error payload for invoke and stream failures"""
         return {
-            "response": "I encountered an issue while processing your request. Please try again.",
-            "error": True,
+            **ERROR_RESULT_BASE,
+            "response": response,
             "error_message": error_msg,
-            "type": "error"
+            "session_id": input_data.get("session_id")
         }
 
-
 # Global agent instance
 visa_agent = VisaAssistantAgent()
 
 # Export functions for external use
-def invoke_agent(input_data: Dict[str, Any]) -> Dict[str, Any]:
+def invoke_agent(input_data: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Invoke the visa agent with input data"""
-    return visa_agent.invoke(input_data)
+    return visa_agent.invoke(input_data, config)
+
+async def ainvoke_agent(input_data: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Invoke the visa agent asynchronously with input data"""
+    return await visa_agent.ainvoke(input_data, config)
 
-async def stream_agent(input_data: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+async def stream_agent(input_data: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> AsyncGenerator[Union[TokenEvent, Dict[str, Any]], None]:
     """Stream visa agent responses"""
-    async for chunk in visa_agent.stream(input_data):
+    async for chunk in visa_agent.stream(input_data, config):
         yield chunk
\ No newline at end of file
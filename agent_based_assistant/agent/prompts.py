@@ -1,18 +1,16 @@
 # System prompts for visa assistant agent
 # Purpose: Define the agent's personality, role, and behavior guidelines
 
+import sys
+from functools import lru_cache
 from typing import Any, Dict
+from langchain_core.messages import SystemMessage
 from agent.state import AgentState
+from config.settings import llm_config
 
 
-def get_system_prompt(state: AgentState) -> str:
-    """
-    Generate context-aware system prompt based on current agent state.
-    Provides agent with relevant instructions and context.
-    """
-    
-    # Base system prompt
-    base_prompt = """You are a professional visa assistant agent with access to specialized tools. Your role is to help users with visa consultations and applications.
+# Base system prompt (static, shared by every turn)
+BASE_SYSTEM_PROMPT = """You are a professional visa assistant agent with access to specialized tools. Your role is to help users with visa consultations and applications.
 
 CORE RESPONSIBILITIES:
 1. Answer visa-related questions using general_enquiry tool
@@ -71,6 +69,10 @@ WORKFLOW SEQUENCE AFTER BASIC INFO COLLECTION:
 - Never skip the visa type analysis step
 - CRITICAL: Do NOT call application_detailed_tool until visa_type_analyzer_tool has been called first
 
+PARALLEL TOOL CALLS:
+- Call ONE tool per response, unless the user needs several independent lookups (e.g. general_enquiry_tool and session_management_tool) whose inputs do not depend on each other's output - then call them together in the same response
+- Never call a tool together with a tool whose output it needs (e.g. visa_type_analyzer_tool after base_information_collector_tool)
+
 IMPORTANT: When using greetings_tool, return the tool's exact response without any modifications, enhancements, or additional formatting.
 IMPORTANT: When using general_enquiry_tool, provide concise, brief responses - avoid lengthy explanations unless specifically requested.
 
@@ -89,95 +91,181 @@ CONVERSATIONAL FLOW RULES:
 - Build naturally on previous exchanges
 - Use phrases like "Great!", "Perfect!", "I still need", "Next, I need" """
 
-    # Add context-specific instructions based on current state
-    context_prompt = _get_context_specific_prompt(state)
-    
-    # Combine base and context prompts
-    return f"{base_prompt}\n\n{context_prompt}"
-
 
-def _get_context_specific_prompt(state: AgentState) -> str:
-    """Generate context-specific instructions based on current state"""
-    
-    context_parts = []
-    
-    # Collection context
-    if state.get("collection_in_progress"):
-        if state.get("initial_info"):
-            country = state["initial_info"].get("country", "unknown")
-            purpose = state["initial_info"].get("purpose_of_travel", "unknown")
-            context_parts.append(f"""
+# Context-specific prompt fragments, selected per state in _get_context_specific_prompt
+APPLICATION_CONTEXT_PROMPT = """
 CURRENT APPLICATION CONTEXT:
 - User is applying for {country} visa for {purpose}
 - Application is in progress
 - Continue collecting missing information
-- If user asks unrelated questions, use general_enquiry tool but acknowledge the ongoing application""")
-        else:
-            context_parts.append("""
+- If user asks unrelated questions, use general_enquiry tool but acknowledge the ongoing application"""
+
+COLLECTION_CONTEXT_PROMPT = """
 COLLECTION CONTEXT:
 - User has started an application but basic info is incomplete
 - Prioritize collecting country and purpose of travel
-- Use base_information_collector tool to gather missing initial information""")
-    
-    # Conversation context
-    conversation_context = state.get("conversation_context")
-    if conversation_context == "consultation":
-        context_parts.append("""
+- Use base_information_collector tool to gather missing initial information"""
+
+CONSULTATION_MODE_PROMPT = """
 CONSULTATION MODE:
 - User is in information-gathering mode
 - Focus on providing helpful visa information
-- Be ready to transition to application if user shows interest""")
-    elif conversation_context == "application":
-        context_parts.append("""
+- Be ready to transition to application if user shows interest"""
+
+APPLICATION_MODE_PROMPT = """
 APPLICATION MODE:
 - User is actively applying for a visa
 - Focus on collecting required information systematically
-- Minimize distractions but handle urgent questions""")
-    
-    # Error context
-    if state.get("extraction_retry_count", 0) > 0:
-        context_parts.append("""
+- Minimize distractions but handle urgent questions"""
+
+ERROR_RECOVERY_MODE_PROMPT = """
 ERROR RECOVERY MODE:
 - Previous information extraction had issues
 - Be extra clear in your questions
 - Ask for information in simpler, more direct ways
-- If extraction fails again, offer to start fresh""")
-    
-    # Tool call context
-    tool_call_count = state.get("tool_call_count", 0)
-    if tool_call_count > 5:
-        context_parts.append("""
+- If extraction fails again, offer to start fresh"""
+
+EFFICIENCY_MODE_PROMPT = """
 EFFICIENCY MODE:
 - Multiple tool calls have been made
 - Try to resolve user needs more directly
-- Consider if you need to clarify user intent""")
-    
-    # Session context
-    if state.get("incomplete_session_id"):
-        context_parts.append("""
+- Consider if you need to clarify user intent"""
+
+SESSION_RESUMPTION_PROMPT = """
 SESSION RESUMPTION:
 - User has an incomplete application they may want to resume
 - Offer to continue previous application or start fresh
-- Use session_management tool if user wants to resume""")
-    
-    # Multiple applications context
-    if state.get("multiple_applications"):
-        countries = list(state["multiple_applications"].keys())
-        context_parts.append(f"""
+- Use session_management tool if user wants to resume"""
+
+MULTI_APPLICATION_CONTEXT_PROMPT = """
 MULTI-APPLICATION CONTEXT:
-- User has applications for: {', '.join(countries)}
+- User has applications for: {countries}
 - Keep track of which country is being discussed
-- Use session_management tool to switch between applications""")
-    
-    return "\n".join(context_parts) if context_parts else "CONTEXT: New conversation - no specific context"
+- Use session_management tool to switch between applications"""
 
+CONVERSATION_SUMMARY_PROMPT = """
+EARLIER CONVERSATION (summarized):
+{summary}"""
 
-def get_tool_selection_prompt() -> str:
+NEW_CONVERSATION_PROMPT = "CONTEXT: New conversation - no specific context"
+
+# Used to compact older turns into conversation_summary
+SUMMARIZATION_PROMPT = """Summarize the earlier part of this visa assistant conversation so it can replace the original messages.
+
+Focus on outcomes, not process:
+- Facts the user provided (country, purpose, travelers, dates, personal or document details)
+- Questions that were answered and the key answers given
+- What is still pending or was asked but not yet answered
+
+PREVIOUS SUMMARY:
+{previous_summary}
+
+CONVERSATION:
+{transcript}
+
+Return only the summary as short bullet points."""
+
+
+def get_system_prompt(state: AgentState) -> str:
     """
-    Prompt to help agent make better tool selection decisions.
-    Used when agent needs guidance on which tool to call.
+    Generate context-aware system prompt based on current agent state.
+    Provides agent with relevant instructions and context.
+    """
+    return _build_system_prompt(_get_context_key(state))
+
+
+def get_system_message(state: AgentState) -> SystemMessage:
+    """
+    Return the system message for the current state context.
+    The message is shared across ReAct steps while the context is unchanged.
     """
-    return """
+    return _build_system_message(_get_context_key(state))
+
+
+def _get_context_key(state: AgentState) -> tuple:
+    """Project the state fields that shape the context prompt into a hashable key"""
+    initial_info = state.get("initial_info") or {}
+    return (
+        bool(state.get("collection_in_progress")),
+        bool(initial_info),
+        initial_info.get("country", "unknown"),
+        initial_info.get("purpose_of_travel", "unknown"),
+        state.get("conversation_context"),
+        state.get("extraction_retry_count", 0) > 0,
+        state.get("tool_call_count", 0) > 5,
+        bool(state.get("incomplete_session_id")),
+        tuple(state.get("multiple_applications") or ()),
+        state.get("conversation_summary")
+    )
+
+
+@lru_cache(maxsize=256)
+def _build_system_prompt(context_key: tuple) -> str:
+    """Combine base and context prompts, cached per context key"""
+    return f"{BASE_SYSTEM_PROMPT}\n\n{_get_context_specific_prompt(context_key)}"
+
+
+@lru_cache(maxsize=256)
+def _build_system_message(context_key: tuple) -> SystemMessage:
+    """
+    Wrap the cached system prompt in a reusable SystemMessage.
+    With prompt caching enabled, the static base prompt is sent as its own
+    cache_control block so the provider reuses its prefill across steps and turns.
+    """
+    if not llm_config.prompt_caching_enabled:
+        return SystemMessage(content=_build_system_prompt(context_key))
+    
+    return SystemMessage(content=[
+        {"type": "text", "text": BASE_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": _get_context_specific_prompt(context_key)}
+    ])
+
+
+def _get_context_specific_prompt(context_key: tuple) -> str:
+    """Generate context-specific instructions based on current state"""
+    (collection_in_progress, has_initial_info, country, purpose, conversation_context,
+     in_error_recovery, many_tool_calls, has_incomplete_session, countries,
+     conversation_summary) = context_key
+    
+    context_parts = []
+    
+    # Collection context
+    if collection_in_progress:
+        if has_initial_info:
+            context_parts.append(APPLICATION_CONTEXT_PROMPT.format(country=country, purpose=purpose))
+        else:
+            context_parts.append(COLLECTION_CONTEXT_PROMPT)
+    
+    # Conversation context
+    if conversation_context == "consultation":
+        context_parts.append(CONSULTATION_MODE_PROMPT)
+    elif conversation_context == "application":
+        context_parts.append(APPLICATION_MODE_PROMPT)
+    
+    # Error context
+    if in_error_recovery:
+        context_parts.append(ERROR_RECOVERY_MODE_PROMPT)
+    
+    # Tool call context
+    if many_tool_calls:
+        context_parts.append(EFFICIENCY_MODE_PROMPT)
+    
+    # Session context
+    if has_incomplete_session:
+        context_parts.append(SESSION_RESUMPTION_PROMPT)
+    
+    # Multiple applications context
+    if countries:
+        context_parts.append(MULTI_APPLICATION_CONTEXT_PROMPT.format(countries=", ".join(countries)))
+    
+    # Compacted history context
+    if conversation_summary:
+        context_parts.append(CONVERSATION_SUMMARY_PROMPT.format(summary=conversation_summary))
+    
+    return "\n".join(context_parts) if context_parts else NEW_CONVERSATION_PROMPT
+
+
+TOOL_SELECTION_PROMPT = """
 TOOL SELECTION GUIDE:
 
 When user says: "Hi" or "Hello" → greetings tool
@@ -196,54 +284,42 @@ DECISION FACTORS:
 Choose the tool that best addresses the user's immediate need while considering the overall conversation flow.
 """
 
-
-def get_error_recovery_prompt(error_type: str) -> str:
-    """
-    Generate specific prompts for different error scenarios.
-    Helps agent handle errors gracefully.
-    """
-    error_prompts = {
-        "extraction_failed": """
+ERROR_RECOVERY_PROMPTS = {
+    sys.intern("extraction_failed"): """
 ERROR RECOVERY: Information extraction failed
 - Ask user to provide information more clearly
 - Break down complex requests into simple questions
 - Offer examples of the format you need
 - If this is the second failure, suggest starting over""",
-        
-        "tool_failed": """
+    
+    sys.intern("tool_failed"): """
 ERROR RECOVERY: Tool execution failed
 - Acknowledge the issue professionally
 - Try an alternative approach to help the user
 - Don't reveal technical details to the user
 - Offer to help in a different way""",
-        
-        "state_corrupted": """
+    
+    sys.intern("state_corrupted"): """
 ERROR RECOVERY: State inconsistency detected
 - Start fresh with the user
 - Explain that you need to begin again for accuracy
 - Don't mention technical state issues
 - Focus on helping them achieve their goal""",
-        
-        "timeout": """
+    
+    sys.intern("timeout"): """
 ERROR RECOVERY: Operation timed out
 - Apologize for the delay
 - Offer to try again
 - Suggest the user might want to simplify their request
 - Ensure the user knows you're still available to help"""
-    }
-    
-    return error_prompts.get(error_type, "ERROR RECOVERY: Handle the error professionally and offer alternative assistance.")
+}
 
+DEFAULT_ERROR_RECOVERY_PROMPT = "ERROR RECOVERY: Handle the error professionally and offer alternative assistance."
 
-def get_final_instructions() -> str:
-    """
-    Final instructions that appear at the end of every prompt.
-    Critical behavior guidelines.
-    """
-    return """
+FINAL_INSTRUCTIONS = """
 CRITICAL INSTRUCTIONS:
-1. ALWAYS call exactly ONE tool per response - NEVER call multiple tools or combine tool outputs
-2. Choose the SINGLE most appropriate tool based on user intent and current context
+1. Call ONE tool per response, unless the user needs several independent lookups (e.g. general_enquiry_tool and session_management_tool) whose inputs do not depend on each other's output - then call them together in the same response
+2. Choose the most appropriate tool based on user intent and current context
 3. Do NOT combine greetings_tool with other tools
 4. Do NOT combine general_enquiry_tool with base_information_collector_tool
 5. If unsure which tool to call, default to greetings tool for clarification
@@ -252,4 +328,28 @@ CRITICAL INSTRUCTIONS:
 8. Handle context switching smoothly without losing track of ongoing processes
 9. Provide clear next steps to users
 10. Never expose technical details or error messages to users
-11. SPECIAL: For greetings_tool outputs, return the response exactly as provided without any modifications or enhancements"""
\ No newline at end of file
+11. SPECIAL: For greetings_tool outputs, return the response exactly as provided without any modifications or enhancements"""
+
+
+def get_tool_selection_prompt() -> str:
+    """
+    Prompt to help agent make better tool selection decisions.
+    Used when agent needs guidance on which tool to call.
+    """
+    return TOOL_SELECTION_PROMPT
+
+
+def get_error_recovery_prompt(error_type: str) -> str:
+    """
+    Generate specific prompts for different error scenarios.
+    Helps agent handle errors gracefully.
+    """
+    return ERROR_RECOVERY_PROMPTS.get(error_type, DEFAULT_ERROR_RECOVERY_PROMPT)
+
+
+def get_final_instructions() -> str:
+    """
+    Final instructions that appear at the end of every prompt.
+    Critical behavior guidelines.
+    """
+    return FINAL_INSTRUCTIONS
\ No newline at end of file
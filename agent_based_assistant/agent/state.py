@@ -1,10 +1,57 @@
 # State schema for agent-based visa assistant
 # Purpose: Define the state structure for the React Agent following LangGraph documentation
 
+import time
+from types import MappingProxyType
 from typing import Annotated, Any, Optional
 from typing_extensions import TypedDict
-from langgraph.graph.message import add_messages
-from operator import add
+from langchain_core.messages import RemoveMessage
+from langgraph.graph.message import add_messages, REMOVE_ALL_MESSAGES
+
+from config.settings import app_config
+
+
+def append_reducer(left: list, right) -> list:
+    """
+    Reducer for accumulator channels: like operator.add, but also accepts a
+    single record. Returns a new list; LangGraph shares channel values with
+    checkpoints, so the left side must never be modified.
+    """
+    if right is None:
+        return left
+    if isinstance(right, list):
+        return left + right
+    return [*left, right]
+
+
+def ring_reducer(cap: int):
+    """
+    Build an append reducer that keeps only the newest `cap` records,
+    so long sessions hold a bounded list.
+    """
+    def reducer(left: list, right) -> list:
+        if right is None:
+            return left
+        new = right if isinstance(right, list) else [right]
+        return (left + new)[-cap:]
+    return reducer
+
+
+def merge_applications(left: dict, right: Optional[dict]) -> dict:
+    """
+    Reducer for multiple_applications: merge per-country updates into a new
+    dict so parallel tool calls for different countries can write in the same step.
+    """
+    merged = dict(left or {})
+    if not right:
+        return merged
+    for country, application in right.items():
+        if application is None:
+            merged.pop(country, None)
+        else:
+            merged[country] = {**merged.get(country, {}), **application}
+    return merged
+
 
 class AgentState(TypedDict):
     """
@@ -14,6 +61,10 @@ class AgentState(TypedDict):
     - messages: List of conversation messages with add_messages reducer
     - Custom fields: Using Optional types for visa-specific data
     - Collection tracking: Fields to manage iterative data collection
+    
+    Kept as a TypedDict rather than a Pydantic model: the prompt hook, the
+    pre-model hook, _prepare_state and the API layer all use mapping access
+    (state.get / state[key]), which LangGraph only provides for dict schemas.
     """
     
     # Core conversation messages (required for React Agent)
@@ -28,22 +79,22 @@ class AgentState(TypedDict):
     initial_info: Optional[dict[str, Any]]  # {"country": "thailand", "purpose_of_travel": "tourism", "number_of_travelers": 2, "travel_dates": "24/01/26 to 02/02/26"}
     
     # Detailed visa application data (accumulated via tools)
-    personal_info: Annotated[list[dict[str, Any]], add]        # Name, DOB, nationality, address, phone, email
-    passport_info: Annotated[list[dict[str, Any]], add]        # Passport number, issue date, expiry, place of issue
-    travel_details: Annotated[list[dict[str, Any]], add]       # Entry/exit dates, purpose, duration, previous visits, num_travelers, destination
-    employment_info: Annotated[list[dict[str, Any]], add]      # Job title, employer, salary, work address
-    financial_info: Annotated[list[dict[str, Any]], add]       # Bank statements, income proof, sponsor details
-    accommodation_info: Annotated[list[dict[str, Any]], add]   # Hotel bookings, invitation letters, host details
-    document_uploads: Annotated[list[dict[str, Any]], add]     # Photos, certificates, medical reports
-    emergency_contacts: Annotated[list[dict[str, Any]], add]   # Next of kin details
-    insurance_info: Annotated[list[dict[str, Any]], add]       # Travel insurance details
-    visa_details: Annotated[list[dict[str, Any]], add]         # Previous visa applications, refusals, visa_type
+    personal_info: Annotated[list[dict[str, Any]], append_reducer]        # Name, DOB, nationality, address, phone, email
+    passport_info: Annotated[list[dict[str, Any]], append_reducer]        # Passport number, issue date, expiry, place of issue
+    travel_details: Annotated[list[dict[str, Any]], append_reducer]       # Entry/exit dates, purpose, duration, previous visits, num_travelers, destination
+    employment_info: Annotated[list[dict[str, Any]], append_reducer]      # Job title, employer, salary, work address
+    financial_info: Annotated[list[dict[str, Any]], append_reducer]       # Bank statements, income proof, sponsor details
+    accommodation_info: Annotated[list[dict[str, Any]], append_reducer]   # Hotel bookings, invitation letters, host details
+    document_uploads: Annotated[list[dict[str, Any]], append_reducer]     # Photos, certificates, medical reports
+    emergency_contacts: Annotated[list[dict[str, Any]], append_reducer]   # Next of kin details
+    insurance_info: Annotated[list[dict[str, Any]], append_reducer]       # Travel insurance details
+    visa_details: Annotated[list[dict[str, Any]], append_reducer]         # Previous visa applications, refusals, visa_type
     
     # === Agent-specific Control Fields ===
     
     # Collection progress tracking
     collection_in_progress: Optional[bool]                     # True when actively collecting visa application data
-    missing_fields: Optional[list[str]]                        # List of required fields still needed
+    missing_fields: Optional[frozenset[str]]                   # Required fields still needed (set for O(1) membership)
     current_collection_stage: Optional[str]                    # "basic", "detailed", "documents", etc.
     
     # Session management
@@ -61,12 +112,12 @@ class AgentState(TypedDict):
     
     # Session and performance management
     session_metadata: Optional[dict[str, Any]]                 # Timestamps, user_agent, request_count
-    active_tools: Optional[list[str]]                          # Currently active tool calls
+    active_tools: Optional[frozenset[str]]                     # Currently active tool calls
     tool_call_count: Optional[int]                             # Prevent infinite tool loops (reset each turn)
-    error_history: Annotated[list[dict[str, Any]], add]        # Track recurring issues with timestamps
+    error_history: Annotated[list[dict[str, Any]], ring_reducer(app_config.max_error_history)]  # Recent issues with timestamps (bounded)
     
     # Multi-application support for scalability
-    multiple_applications: Optional[dict[str, dict[str, Any]]] # {"thailand": {...}, "vietnam": {...}}
+    multiple_applications: Annotated[dict[str, dict[str, Any]], merge_applications]  # {"thailand": {...}, "vietnam": {...}}; None value drops a country
     primary_application: Optional[str]                         # Which country is current focus
     
     # Performance optimization
@@ -127,10 +178,9 @@ def validate_agent_state(state: AgentState) -> tuple[bool, list[str]]:
 
 
 def create_error_record(error_type: str, error_message: str, tool_name: str = None) -> dict[str, Any]:
-    """Create standardized error record for error_history"""
-    import time
+    """Create standardized error record for error_history (timestamp in epoch nanoseconds)"""
     return {
-        "timestamp": time.time(),
+        "timestamp": time.time_ns(),
         "error_type": error_type,
         "message": error_message,
         "tool": tool_name,
@@ -138,21 +188,25 @@ def create_error_record(error_type: str, error_message: str, tool_name: str = No
     }
 
 
+# Field values restored by reset_session_state (read-only, copied per reset)
+FRESH_STATE_TEMPLATE = MappingProxyType({
+    "initial_info": None,
+    "collection_in_progress": False,
+    "missing_fields": None,
+    "extraction_retry_count": 0,
+    "last_extraction_error": None,
+    "conversation_context": None,
+    "tool_call_count": 0
+})
+
+
 def reset_session_state(state: AgentState, keep_messages: bool = True) -> dict[str, Any]:
     """
     Reset state for fresh start while preserving conversation if needed.
     Used for error recovery and session cleanup.
     """
-    fresh_state = {
-        "initial_info": None,
-        "collection_in_progress": False,
-        "missing_fields": None,
-        "extraction_retry_count": 0,
-        "last_extraction_error": None,
-        "conversation_context": None,
-        "tool_call_count": 0,
-        "state_version": (state.get("state_version", 0) + 1)
-    }
+    fresh_state = dict(FRESH_STATE_TEMPLATE)
+    fresh_state["state_version"] = state.get("state_version", 0) + 1
     
     if keep_messages:
         fresh_state["messages"] = state.get("messages", [])
@@ -160,34 +214,94 @@ def reset_session_state(state: AgentState, keep_messages: bool = True) -> dict[s
     return fresh_state
 
 
+# Sections required for a complete application, in display order
+REQUIRED_SECTIONS = ("initial_info", "personal_info", "passport_info", "travel_details")
+
+
+def _build_progress_table() -> tuple:
+    """Precompute (completed, next_required, percentage) for every completion bitmask"""
+    table = []
+    for mask in range(1 << len(REQUIRED_SECTIONS)):
+        completed = tuple(section for i, section in enumerate(REQUIRED_SECTIONS) if mask & (1 << i))
+        next_required = tuple(section for section in REQUIRED_SECTIONS if section not in completed)
+        table.append((completed, next_required, (len(completed) / len(REQUIRED_SECTIONS)) * 100))
+    return tuple(table)
+
+
+PROGRESS_TABLE = _build_progress_table()
+
+
 def get_application_progress(state: AgentState) -> dict[str, Any]:
     """
     Calculate application completion progress for UI display.
     Returns progress information and next steps.
     """
-    progress = {
-        "stage": "not_started",
-        "completion_percentage": 0,
-        "completed_sections": [],
-        "next_required": []
-    }
-    
     if not state.get("initial_info"):
-        return progress
+        return {
+            "stage": "not_started",
+            "completion_percentage": 0,
+            "completed_sections": [],
+            "next_required": []
+        }
     
-    # Calculate completion based on collected data
-    required_sections = ["initial_info", "personal_info", "passport_info", "travel_details"]
-    completed = []
-    
-    for section in required_sections:
+    # Single pass over required sections into a completion bitmask
+    mask = 0
+    for bit, section in enumerate(REQUIRED_SECTIONS):
         if state.get(section):
-            completed.append(section)
+            mask |= 1 << bit
+    completed, next_required, percentage = PROGRESS_TABLE[mask]
     
-    progress.update({
+    return {
         "stage": "in_progress" if completed else "basic_complete",
-        "completion_percentage": (len(completed) / len(required_sections)) * 100,
-        "completed_sections": completed,
-        "next_required": [s for s in required_sections if s not in completed]
-    })
+        "completion_percentage": percentage,
+        "completed_sections": list(completed),
+        "next_required": list(next_required)
+    }
+
+
+def estimate_tokens(messages: list) -> int:
+    """Cheap token estimate (~4 characters per token) used for compaction decisions"""
+    return count_chars(messages) // 4
+
+
+def count_chars(messages: list) -> int:
+    """Total content length of messages"""
+    return sum(len(str(message.content)) for message in messages)
+
+
+def compact_messages(state: AgentState, summarize, keep_last: int = 6, token_budget: int = 8000) -> dict[str, Any]:
+    """
+    Collapse older turns into conversation_summary once history exceeds the token budget.
+    summarize(messages, previous_summary) returns the new summary text.
+    A running character count is kept in session_metadata so each check only
+    measures messages added since the previous call.
+    Returns a state update (possibly just the updated counters).
+    """
+    messages = state.get("messages") or []
+    metadata = state.get("session_metadata") or {}
+    counted = metadata.get("counted_messages", 0)
+    total_chars = metadata.get("total_chars", 0)
+    if counted > len(messages):
+        # History was replaced outside compaction; recount from scratch
+        counted = total_chars = 0
+    total_chars += count_chars(messages[counted:])
+    
+    update = {"session_metadata": {**metadata, "counted_messages": len(messages), "total_chars": total_chars}}
+    if len(messages) <= keep_last or total_chars // 4 <= token_budget:
+        return update
+    
+    # Start the kept window at a user turn so no tool result is separated from its call
+    split = len(messages) - keep_last
+    while split > 0 and getattr(messages[split], "type", None) != "human":
+        split -= 1
+    if split == 0:
+        return update
     
-    return progress
\ No newline at end of file
+    kept_messages = messages[split:]
+    summary = summarize(messages[:split], state.get("conversation_summary"))
+    return {
+        "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *kept_messages],
+        "conversation_summary": summary,
+        "session_metadata": {**metadata, "counted_messages": len(kept_messages), "total_chars": count_chars(kept_messages)},
+        "state_version": (state.get("state_version") or 0) + 1
+    }
@@ -1,15 +1,38 @@
 # Configuration settings for agent-based visa assistant
 # Purpose: LLM setup, environment variables, and other configurations
 
+import asyncio
+import hashlib
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import re
 import time
 from typing import Any, Optional
 from langchain.chat_models import init_chat_model
+from langchain_core.caches import InMemoryCache
+from langchain_core.globals import set_llm_cache
 from langchain_core.language_models import BaseChatModel
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# LangGraph does not emit "messages" stream events for LLM calls carrying this tag
+NOSTREAM_TAG = "nostream"
+
+# Successful LLM probes are remembered here so process starts skip the round-trip
+PROBE_CACHE_PATH = os.path.expanduser("~/.cache/visa-agent/probe.json")
+
+# Errors matching these patterns fail immediately instead of being retried
+NON_RETRYABLE_ERROR_PATTERN = re.compile(
+    r"api key|authentication|authorization|invalid request|malformed",
+    re.IGNORECASE
+)
+
 # LLM Configuration with Error Handling and Streaming
 
 class LLMConfig:
@@ -23,8 +46,18 @@ class LLMConfig:
         self.retry_delay = float(os.getenv("LLM_RETRY_DELAY", "1.0"))
         self.timeout = int(os.getenv("LLM_TIMEOUT", "30"))
         self.streaming_enabled = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+        self.skip_init_probe = os.getenv("LLM_SKIP_INIT_PROBE") == "1"
+        self.probe_cache_ttl = int(os.getenv("LLM_PROBE_CACHE_TTL", os.getenv("CACHE_TTL", "300")))
+        self.probe_ok = False
+        # Anthropic prompt caching for the static system prompt prefix
+        self.prompt_caching_enabled = (
+            os.getenv("PROMPT_CACHING_ENABLED", "true").lower() == "true"
+            and self.model_name.startswith("anthropic:")
+        )
         
         self.llm = self._initialize_llm()
+        # Tool-internal calls are tagged so LangGraph's "messages" stream skips their tokens
+        self.tool_llm = self.llm.with_config(tags=[NOSTREAM_TAG])
     
     def _initialize_llm(self) -> BaseChatModel:
         """Initialize LLM with error handling and validation"""
@@ -42,25 +75,70 @@ class LLMConfig:
                 timeout=self.timeout
             )
             
-            # Test the model
-            test_response = llm.invoke([{"role": "user", "content": "Hello"}])
-            if not test_response or not test_response.content:
-                raise RuntimeError("LLM initialization test failed")
+            # Test the model (cached across process starts, skippable via LLM_SKIP_INIT_PROBE=1)
+            if not self.skip_init_probe:
+                self.probe(llm)
             
             # LLM initialized successfully - no print for clean terminal
             return llm
             
         except Exception as e:
-            print(f"LLM initialization failed: {e}")
+            logger.error("LLM initialization failed: %s", e)
             raise RuntimeError(f"Failed to initialize LLM: {e}")
     
+    def probe(self, llm: Optional[BaseChatModel] = None) -> None:
+        """Verify the model answers, reusing a recent successful probe for the same model and key"""
+        if self.probe_ok:
+            return
+        
+        probe_key = self._probe_key()
+        if self._is_probe_cached(probe_key):
+            self.probe_ok = True
+            return
+        
+        test_response = (llm or self.llm).invoke([{"role": "user", "content": "Hello"}])
+        if not test_response or not test_response.content:
+            raise RuntimeError("LLM initialization test failed")
+        
+        self.probe_ok = True
+        self._save_probe(probe_key)
+    
+    def _probe_key(self) -> str:
+        """Probe cache key: model name plus a hash of the API key"""
+        api_key = os.getenv("ANTHROPIC_API_KEY", "")
+        return f"{self.model_name}:{hashlib.sha256(api_key.encode()).hexdigest()[:16]}"
+    
+    def _is_probe_cached(self, probe_key: str) -> bool:
+        """Check for an unexpired successful probe"""
+        try:
+            with open(PROBE_CACHE_PATH, 'r') as f:
+                probed_at = json.load(f).get(probe_key)
+        except (OSError, ValueError):
+            return False
+        return probed_at is not None and time.time() - probed_at < self.probe_cache_ttl
+    
+    def _save_probe(self, probe_key: str) -> None:
+        """Record a successful probe; cache write failures are not fatal"""
+        try:
+            with open(PROBE_CACHE_PATH, 'r') as f:
+                probes = json.load(f)
+        except (OSError, ValueError):
+            probes = {}
+        probes[probe_key] = time.time()
+        try:
+            os.makedirs(os.path.dirname(PROBE_CACHE_PATH), exist_ok=True)
+            with open(PROBE_CACHE_PATH, 'w') as f:
+                json.dump(probes, f)
+        except OSError:
+            pass
+    
     def invoke_with_retry(self, messages: list, **kwargs) -> Any:
         """Invoke LLM with retry logic and error handling"""
         last_error = None
         
         for attempt in range(self.max_retries + 1):
             try:
-                response = self.llm.invoke(messages, timeout=self.timeout, **kwargs)
+                response = self.tool_llm.invoke(messages, timeout=self.timeout, **kwargs)
                 
                 if not response or not response.content:
                     raise RuntimeError("Empty response from LLM")
@@ -69,57 +147,103 @@ class LLMConfig:
                 
             except Exception as e:
                 last_error = e
-                
-                if self._is_non_retryable_error(e):
-                    print(f"Non-retryable LLM error: {e}")
-                    raise e
-                
-                if attempt < self.max_retries:
-                    wait_time = self.retry_delay * (2 ** attempt)
-                    print(f"LLM attempt {attempt + 1} failed: {e}. Retrying in {wait_time}s...")
+                wait_time = self._retry_wait(e, attempt, "LLM")
+                if wait_time is not None:
                     time.sleep(wait_time)
-                else:
-                    print(f"LLM failed after {self.max_retries + 1} attempts: {e}")
         
         raise RuntimeError(f"LLM invocation failed after all retries: {last_error}")
     
     def stream_with_retry(self, messages: list, **kwargs):
-        """Stream LLM response with retry logic"""
+        """
+        Stream LLM response with retry logic. Only a stream that fails before its
+        first chunk is retried; a retry after that would replay the answer from the start.
+        """
         last_error = None
         
         for attempt in range(self.max_retries + 1):
+            started = False
             try:
                 for chunk in self.llm.stream(messages, timeout=self.timeout, **kwargs):
+                    started = True
                     yield chunk
                 return
                 
             except Exception as e:
+                if started:
+                    raise
                 last_error = e
+                wait_time = self._retry_wait(e, attempt, "streaming")
+                if wait_time is not None:
+                    time.sleep(wait_time)
+        
+        raise RuntimeError(f"LLM streaming failed after all retries: {last_error}")
+    
+    async def ainvoke_with_retry(self, messages: list, **kwargs) -> Any:
+        """Async invoke with retry logic; backoff waits do not block the event loop"""
+        last_error = None
+        
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.tool_llm.ainvoke(messages, timeout=self.timeout, **kwargs)
                 
-                if self._is_non_retryable_error(e):
-                    print(f"Non-retryable streaming error: {e}")
-                    raise e
+                if not response or not response.content:
+                    raise RuntimeError("Empty response from LLM")
                 
-                if attempt < self.max_retries:
-                    wait_time = self.retry_delay * (2 ** attempt)
-                    print(f"Streaming attempt {attempt + 1} failed: {e}. Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                else:
-                    print(f"Streaming failed after {self.max_retries + 1} attempts: {e}")
+                return response
+                
+            except Exception as e:
+                last_error = e
+                wait_time = self._retry_wait(e, attempt, "LLM")
+                if wait_time is not None:
+                    await asyncio.sleep(wait_time)
+        
+        raise RuntimeError(f"LLM invocation failed after all retries: {last_error}")
+    
+    async def astream_with_retry(self, messages: list, **kwargs):
+        """
+        Async stream with retry logic; backoff waits do not block the event loop.
+        Only a stream that fails before its first chunk is retried.
+        """
+        last_error = None
+        
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                async for chunk in self.llm.astream(messages, timeout=self.timeout, **kwargs):
+                    started = True
+                    yield chunk
+                return
+                
+            except Exception as e:
+                if started:
+                    raise
+                last_error = e
+                wait_time = self._retry_wait(e, attempt, "streaming")
+                if wait_time is not None:
+                    await asyncio.sleep(wait_time)
         
         raise RuntimeError(f"LLM streaming failed after all retries: {last_error}")
     
+    def _retry_wait(self, error: Exception, attempt: int, operation: str) -> Optional[float]:
+        """
+        Backoff before the next attempt, or None after the last one (shared by the
+        sync and async retry loops). Non-retryable errors are re-raised immediately.
+        """
+        if self._is_non_retryable_error(error):
+            logger.error("Non-retryable %s error: %s", operation, error)
+            raise error
+        
+        if attempt < self.max_retries:
+            wait_time = self.retry_delay * (2 ** attempt)
+            logger.warning("%s attempt %d failed: %s. Retrying in %ss...", operation, attempt + 1, error, wait_time)
+            return wait_time
+        
+        logger.error("%s failed after %d attempts: %s", operation, self.max_retries + 1, error)
+        return None
+    
     def _is_non_retryable_error(self, error: Exception) -> bool:
         """Determine if error should not be retried"""
-        error_str = str(error).lower()
-        non_retryable_patterns = [
-            "api key",
-            "authentication",
-            "authorization", 
-            "invalid request",
-            "malformed"
-        ]
-        return any(pattern in error_str for pattern in non_retryable_patterns)
+        return NON_RETRYABLE_ERROR_PATTERN.search(str(error)) is not None
 
 
 # Application Settings
@@ -147,17 +271,44 @@ class AppConfig:
         # Performance
         self.enable_caching = os.getenv("ENABLE_CACHING", "true").lower() == "true"
         self.cache_ttl = int(os.getenv("CACHE_TTL", "300"))
+        self.llm_cache_size = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+        
+        # Conversation compaction
+        self.compaction_keep_last = int(os.getenv("COMPACTION_KEEP_LAST", "6"))
+        self.compaction_token_budget = int(os.getenv("COMPACTION_TOKEN_BUDGET", "8000"))
         
         # Streaming settings
         self.streaming_chunk_size = int(os.getenv("STREAMING_CHUNK_SIZE", "1024"))
         self.streaming_timeout = int(os.getenv("STREAMING_TIMEOUT", "60"))
 
 
+# Logging
+
+def configure_logging(level: Optional[str] = None) -> logging.handlers.QueueListener:
+    """
+    Route log records through a queue so handler I/O runs on a background thread
+    instead of the event loop. Returns the started listener; call stop() on shutdown.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(), respect_handler_level=True)
+    
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level or app_config.error_log_level)
+    
+    listener.start()
+    return listener
+
+
 # Global Instances
 
 llm_config = LLMConfig()
 app_config = AppConfig()
 
+# Identical prompt + model calls (e.g. repeated extractions) are answered from memory
+if app_config.enable_caching:
+    set_llm_cache(InMemoryCache(maxsize=app_config.llm_cache_size))
+
 # Export LLM instance for backward compatibility
 llm = llm_config.llm
 
@@ -170,6 +321,14 @@ def stream_llm_safe(messages: list, **kwargs):
     """Safe LLM streaming with retry logic"""
     return llm_config.stream_with_retry(messages, **kwargs)
 
+async def ainvoke_llm_safe(messages: list, **kwargs) -> Any:
+    """Safe async LLM invocation with retry logic"""
+    return await llm_config.ainvoke_with_retry(messages, **kwargs)
+
+def astream_llm_safe(messages: list, **kwargs):
+    """Safe async LLM streaming with retry logic"""
+    return llm_config.astream_with_retry(messages, **kwargs)
+
 
 # Environment Validation
 
@@ -193,7 +352,7 @@ def validate_environment() -> tuple[bool, list[str]]:
         issues.append("LLM_TEMPERATURE must be a valid float")
     
     try:
-        llm_config.llm.invoke([{"role": "user", "content": "test"}])
+        llm_config.probe()
     except Exception as e:
         issues.append(f"LLM configuration test failed: {e}")
     
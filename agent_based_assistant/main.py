@@ -4,11 +4,18 @@
 import sys
 import os
 import asyncio
+import time
 # Add current directory to Python path so agent_based_assistant/ becomes the import root
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from agent.agent import stream_agent
+from agent.agent import VisaAssistantAgent, TokenEvent
+from config.settings import configure_logging
 from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+import uuid
+
+# Streamed tokens are written immediately but flushed to the terminal at most every 16ms
+FLUSH_INTERVAL = 0.016
 
 
 async def main():
@@ -16,12 +23,10 @@ async def main():
     
     print("Type 'quit' to exit\n")
     
-    # Initialize state
-    state = {
-        "messages": [],
-        "tool_call_count": 0,
-        "state_version": 1
-    }
+    # The checkpointer owns the conversation history; the loop only sends new messages
+    agent = VisaAssistantAgent(checkpointer=MemorySaver())
+    session_id = uuid.uuid4().hex
+    config = {"configurable": {"thread_id": session_id}}
     
     while True:
         try:
@@ -34,29 +39,27 @@ async def main():
             if not user_input:
                 continue
             
-            # Add user message
-            state["messages"].append(HumanMessage(content=user_input))
+            # Send only the new user message; add_messages appends it to the thread
+            turn_input = {"messages": [HumanMessage(content=user_input, id=uuid.uuid4().hex)]}
             
             # Stream agent response with token-level streaming
-            print("Agent: ", end="", flush=True)
-            full_response = ""
+            write = sys.stdout.write
+            flush = sys.stdout.flush
+            write("Agent: ")
+            flush()
+            last_flush = time.monotonic()
             
-            async for chunk in stream_agent(state):
-                if chunk is None:
-                    continue  # Skip None chunks (filtered out chunks)
-                    
-                if chunk.get("type") == "token":
+            async for chunk in agent.stream(turn_input, config):
+                if isinstance(chunk, TokenEvent):
                     # Real-time token streaming (following LangGraph docs pattern)
-                    token_text = chunk["token"]
-                    print(token_text, end="", flush=True)
-                    full_response += token_text
+                    write(chunk.token)
+                    now = time.monotonic()
+                    if now - last_flush >= FLUSH_INTERVAL:
+                        flush()
+                        last_flush = now
             
-            # Add newline after streaming and update state
-            print()  # New line after streaming
-            if full_response:
-                # Add the complete response to our state messages
-                from langchain_core.messages import AIMessage
-                state["messages"].append(AIMessage(content=full_response))
+            write("\n")  # New line after streaming
+            flush()
             
         except KeyboardInterrupt:
             print("\nGoodbye!")
@@ -66,4 +69,8 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    log_listener = configure_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
\ No newline at end of file
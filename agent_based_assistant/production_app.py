@@ -1,65 +1,117 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Dict, Any
+import asyncio
+import logging
 import os
 import uuid
-import json
+from weakref import WeakValueDictionary
+import orjson
 from langchain_core.messages import HumanMessage
 
 # Import agent-based system
-from agent.agent import stream_agent, invoke_agent
+from agent.agent import stream_agent, ainvoke_agent, TokenEvent
 from agent.state import AgentState
+from thread_store import create_thread_store, MemoryThreadStore, StateConflictError
+
+logger = logging.getLogger(__name__)
+
+# Per-thread state storage (Redis when REDIS_URL is set, in-process otherwise)
+thread_store = create_thread_store()
+
+# One lock per active thread; entries disappear once no request holds them
+thread_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+
+def _thread_lock(thread_id: str) -> asyncio.Lock:
+    """Lock guarding read-modify-write of one thread's state"""
+    lock = thread_locks.get(thread_id)
+    if lock is None:
+        lock = thread_locks[thread_id] = asyncio.Lock()
+    return lock
+
+
+# Thread state fields set explicitly on agent input rather than copied over
+RESERVED_STATE_KEYS = frozenset({"messages", "session_id", "tool_call_count", "state_version"})
+
+
+def _new_thread_state(thread_id: str) -> Dict[str, Any]:
+    """Initial state for a thread that has not been stored yet"""
+    return {
+        "messages": [],
+        "session_id": thread_id,
+        "tool_call_count": 0,
+        "state_version": 1
+    }
+
+
+# Constant parts of a streamed AI token event:
+# data: {"id":"ai_<thread>_<n>","type":"ai","content":<token>,"created_at":"..."}
+AI_EVENT_ID_HEAD = b'data: {"id":'
+AI_EVENT_CONTENT_HEAD = b'","type":"ai","content":'
+AI_EVENT_TAIL = b',"created_at":"2025-01-01T00:00:00Z"}\n\n'
+
+
+def _sse_event(payload: Dict[str, Any]) -> bytes:
+    """Encode one server-sent event (orjson serializes straight to bytes)"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+def _text_from_dict(content: dict) -> str:
+    """Handle dict format like {'text': 'Hello!', 'type': 'text'}"""
+    if 'text' in content:
+        return str(content['text'])
+    if 'content' in content:
+        return str(content['content'])
+    # Fallback to string representation
+    return str(content)
+
+
+def _text_from_list(content: list) -> str:
+    """Handle list format like [{'text': 'Hello!', 'type': 'text'}]"""
+    return ' '.join([
+        _text_from_dict(item) if type(item) is dict else str(item)
+        for item in content
+    ])
+
+
+# Content extractors keyed by exact type; anything else falls back to str()
+CONTENT_EXTRACTORS = {
+    str: str,
+    list: _text_from_list,
+    dict: _text_from_dict
+}
 
-# Global state management for threads
-thread_states = {}
 
 def _extract_clean_content(content) -> str:
     """Extract clean text content from potentially complex message content"""
-    if isinstance(content, str):
-        return content
-    elif isinstance(content, list):
-        # Handle list format like [{'text': 'Hello!', 'type': 'text'}]
-        text_parts = []
-        for item in content:
-            if isinstance(item, dict):
-                if 'text' in item:
-                    text_parts.append(str(item['text']))
-                elif 'content' in item:
-                    text_parts.append(str(item['content']))
-                else:
-                    # Fallback to string representation
-                    text_parts.append(str(item))
-            else:
-                text_parts.append(str(item))
-        return ' '.join(text_parts)
-    elif isinstance(content, dict):
-        # Handle dict format like {'text': 'Hello!', 'type': 'text'}
-        if 'text' in content:
-            return str(content['text'])
-        elif 'content' in content:
-            return str(content['content'])
-        else:
-            # Fallback to string representation
-            return str(content)
-    else:
-        # Fallback for any other type
-        return str(content)
+    return CONTENT_EXTRACTORS.get(type(content), str)(content)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("✅ Agent-based Visa Assistant Production Server initialized")
+    # Sync graph work (sync tools, the compaction hook) runs on the default executor;
+    # size it for LLM provider concurrency rather than CPU count
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=int(os.getenv("AGENT_WORKERS", "8")), thread_name_prefix="agent")
+    )
+    logger.info("Agent-based Visa Assistant Production Server initialized")
     yield
     # Shutdown
-    print("🔄 Server shutdown")
+    logger.info("Server shutdown")
+    if isinstance(thread_store, MemoryThreadStore):
+        logger.info("Thread store held %d threads at shutdown", len(thread_store))
 
 app = FastAPI(
     title="Agent-based Visa Agent API",
     description="Production Agent-based Visa Assistant using LangGraph React Agent",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -76,89 +128,81 @@ class MessageRequest(BaseModel):
     messages: List[Dict[str, Any]]
 
 class ThreadResponse(BaseModel):
-    thread_id: str
+    thread_id: str  # 32-character hex UUID (no hyphens)
 
 class RunResponse(BaseModel):
     messages: List[Dict[str, Any]]
 
+# Static endpoint payloads (built once, not per request)
+HEALTH_RESPONSE = {"status": "healthy", "service": "agent-based-visa-agent"}
+ASSISTANT_INFO = {
+    "assistant_id": "visa_agent",
+    "graph_id": "visa_agent", 
+    "config": {},
+    "metadata": {"type": "agent_based"}
+}
+
+# I/O-free handlers are async so FastAPI runs them on the event loop, not the thread pool
 @app.get("/health")
-def health_check():
-    return {"status": "healthy", "service": "agent-based-visa-agent"}
+async def health_check():
+    return HEALTH_RESPONSE
 
 # LangGraph React SDK compatible endpoints
 @app.get("/assistants/{assistant_id}")
 async def get_assistant(assistant_id: str):
     if assistant_id == "visa_agent":
-        return {
-            "assistant_id": "visa_agent",
-            "graph_id": "visa_agent", 
-            "config": {},
-            "metadata": {"type": "agent_based"}
-        }
+        return ASSISTANT_INFO
     raise HTTPException(status_code=404, detail="Assistant not found")
 
 @app.post("/threads", response_model=ThreadResponse)
 async def create_thread():
-    thread_id = str(uuid.uuid4())
+    thread_id = uuid.uuid4().hex
     # Initialize thread state
-    thread_states[thread_id] = {
-        "messages": [],
-        "session_id": thread_id,
-        "tool_call_count": 0,
-        "state_version": 1
-    }
+    await thread_store.put(thread_id, _new_thread_state(thread_id), expected_version=0)
     return ThreadResponse(thread_id=thread_id)
 
-@app.post("/threads/{thread_id}/runs/wait", response_model=RunResponse)
+# Output is built here from trusted data: skip FastAPI's response validation, keep the schema in the docs
+@app.post("/threads/{thread_id}/runs/wait", response_model=None, responses={200: {"model": RunResponse}})
 async def run_thread(thread_id: str, request: MessageRequest):
     try:
         # Get the latest user message
         user_message = request.messages[-1]["content"]
         
-        # Get current thread state or create new one
-        if thread_id not in thread_states:
-            thread_states[thread_id] = {
-                "messages": [],
+        # Serialize turns on the same thread within this process (the store's
+        # version check still guards against other workers)
+        async with _thread_lock(thread_id):
+            # Get current thread state or create new one
+            current_state = await thread_store.get(thread_id) or _new_thread_state(thread_id)
+            expected_version = current_state["state_version"]
+            
+            # Add user message to state
+            user_msg = HumanMessage(content=user_message)
+            current_state["messages"].append(user_msg)
+            
+            # Prepare input for agent
+            agent_input = {
+                "messages": current_state["messages"],
                 "session_id": thread_id,
-                "tool_call_count": 0,
-                "state_version": 1
+                "tool_call_count": current_state.get("tool_call_count", 0),
+                "state_version": current_state.get("state_version", 1)
             }
-        
-        current_state = thread_states[thread_id]
-        
-        # Add user message to state
-        user_msg = HumanMessage(content=user_message)
-        current_state["messages"].append(user_msg)
-        
-        # Prepare input for agent
-        agent_input = {
-            "messages": current_state["messages"],
-            "session_id": thread_id,
-            "tool_call_count": current_state.get("tool_call_count", 0),
-            "state_version": current_state.get("state_version", 1)
-        }
-        
-        # Add any existing state fields
-        for key, value in current_state.items():
-            if key not in ["messages", "session_id", "tool_call_count", "state_version"] and value is not None:
-                agent_input[key] = value
-        
-        # Run the agent
-        result = invoke_agent(agent_input)
-        
-        # Update thread state with result
-        thread_states[thread_id].update(result)
+            
+            # Add any existing state fields
+            agent_input.update({
+                key: value for key, value in current_state.items()
+                if key not in RESERVED_STATE_KEYS and value is not None
+            })
+            
+            # Run the agent
+            result = await ainvoke_agent(agent_input)
+            
+            # Update thread state with result (fails if another request updated the thread meanwhile)
+            current_state.update(result)
+            await thread_store.put(thread_id, current_state, expected_version)
         
         # Extract response messages - handle both message objects and direct responses
         response_messages = []
         
-        # Debug: Print what we got from agent
-        print(f"Agent result keys: {result.keys()}")
-        if "messages" in result:
-            print(f"Messages type: {type(result['messages'])}")
-            if result["messages"]:
-                print(f"First message type: {type(result['messages'][-1])}")
-        
         if "messages" in result and result["messages"]:
             # Get the last AI message
             for msg in reversed(result["messages"]):
@@ -186,28 +230,27 @@ async def run_thread(thread_id: str, request: MessageRequest):
                 "content": "I processed your request but couldn't generate a proper response. Please try again."
             })
         
-        return RunResponse(messages=response_messages)
+        return RunResponse.model_construct(messages=response_messages)
         
+    except StateConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        print(f"❌ Error in run_thread: {e}")
+        logger.exception("Error in run_thread")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/threads/{thread_id}/state")
 async def get_thread_state(thread_id: str):
     try:
-        if thread_id in thread_states:
+        state = await thread_store.get(thread_id)
+        if state is not None:
             # Return clean state without internal message objects
-            state = thread_states[thread_id].copy()
-            # Convert messages to serializable format
+            # (the store already hands out a copy, so messages are replaced in place)
             if "messages" in state:
-                serializable_messages = []
-                for msg in state["messages"]:
-                    if hasattr(msg, 'type') and hasattr(msg, 'content'):
-                        serializable_messages.append({
-                            "type": msg.type,
-                            "content": msg.content
-                        })
-                state["messages"] = serializable_messages
+                state["messages"] = [
+                    {"type": msg.type, "content": msg.content}
+                    for msg in state["messages"]
+                    if hasattr(msg, 'type') and hasattr(msg, 'content')
+                ]
             return {"state": state}
         else:
             return {"state": {}}
@@ -229,23 +272,8 @@ async def stream_run(thread_id: str, request: dict):
         
         user_message = messages[-1]["content"]
         
-        # Get current thread state or create new one
-        if thread_id not in thread_states:
-            thread_states[thread_id] = {
-                "messages": [],
-                "session_id": thread_id,
-                "tool_call_count": 0,
-                "state_version": 1
-            }
-        
-        current_state = thread_states[thread_id]
-        
-        # Add user message to state
-        user_msg = HumanMessage(content=user_message)
-        current_state["messages"].append(user_msg)
-        
         async def generate_stream():
-            print(f"Starting agent stream for thread {thread_id}, message: {user_message}")
+            logger.debug("Starting agent stream for thread %s", thread_id)
             
             # First, yield the user message in LangGraph format
             user_message_obj = {
@@ -254,56 +282,72 @@ async def stream_run(thread_id: str, request: dict):
                 "content": user_message,
                 "created_at": "2025-01-01T00:00:00Z"
             }
-            yield f"data: {json.dumps(user_message_obj)}\n\n"
-            
-            # Prepare input for agent streaming
-            agent_input = {
-                "messages": current_state["messages"],
-                "session_id": thread_id,
-                "tool_call_count": current_state.get("tool_call_count", 0),
-                "state_version": current_state.get("state_version", 1)
-            }
+            yield _sse_event(user_message_obj)
             
-            # Add any existing state fields
-            for key, value in current_state.items():
-                if key not in ["messages", "session_id", "tool_call_count", "state_version"] and value is not None:
-                    agent_input[key] = value
-            
-            # Stream the AI response using agent streaming
-            try:
-                async for chunk in stream_agent(agent_input):
-                    if chunk and chunk.get("type") == "token":
-                        ai_message_obj = {
-                            "id": f"ai_{thread_id}_{chunk.get('token', '')[:10]}",
-                            "type": "ai", 
-                            "content": chunk["token"],
-                            "created_at": "2025-01-01T00:00:00Z"
-                        }
-                        yield f"data: {json.dumps(ai_message_obj)}\n\n"
-                        
-            except Exception as stream_error:
-                print(f"Streaming error: {stream_error}")
-                error_message = {
-                    "id": f"error_{thread_id}",
-                    "type": "ai",
-                    "content": "I encountered an issue processing your request. Please try again.",
-                    "created_at": "2025-01-01T00:00:00Z"
-                }
-                yield f"data: {json.dumps(error_message)}\n\n"
+            # Hold the thread's lock for the whole turn, agent run included: this generator only
+            # runs after the response has started, so a lock taken in stream_run would already be released
+            async with _thread_lock(thread_id):
+                try:
+                    # Get current thread state or create new one
+                    current_state = await thread_store.get(thread_id) or _new_thread_state(thread_id)
+                    
+                    # Add user message to state
+                    user_msg = HumanMessage(content=user_message)
+                    current_state["messages"].append(user_msg)
+                    await thread_store.put(thread_id, current_state, current_state["state_version"])
+                    
+                    # Prepare input for agent streaming
+                    agent_input = {
+                        "messages": current_state["messages"],
+                        "session_id": thread_id,
+                        "tool_call_count": current_state.get("tool_call_count", 0),
+                        "state_version": current_state.get("state_version", 1)
+                    }
+                    
+                    # Add any existing state fields
+                    agent_input.update({
+                        key: value for key, value in current_state.items()
+                        if key not in RESERVED_STATE_KEYS and value is not None
+                    })
+                    
+                    # Stream the AI response using agent streaming
+                    # Only the token index and content are encoded per token; the rest is pre-built bytes
+                    # (the id prefix is JSON-encoded once with its closing quote dropped)
+                    ai_event_head = AI_EVENT_ID_HEAD + orjson.dumps(f"ai_{thread_id}_")[:-1]
+                    token_index = 0
+                    async for chunk in stream_agent(agent_input):
+                        if isinstance(chunk, TokenEvent):
+                            yield ai_event_head + str(token_index).encode() + AI_EVENT_CONTENT_HEAD + orjson.dumps(chunk.token) + AI_EVENT_TAIL
+                            token_index += 1
+                            
+                except Exception as stream_error:
+                    # Includes StateConflictError: the response has already started, so report it in the stream
+                    logger.warning("Streaming error: %s", stream_error)
+                    error_message = {
+                        "id": f"error_{thread_id}",
+                        "type": "ai",
+                        "content": "I encountered an issue processing your request. Please try again.",
+                        "created_at": "2025-01-01T00:00:00Z"
+                    }
+                    yield _sse_event(error_message)
             
-            print("Agent stream completed")
+            logger.debug("Agent stream completed for thread %s", thread_id)
         
         return StreamingResponse(
             generate_stream(),
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
-                "Connection": "keep-alive"
+                "Connection": "keep-alive",
+                # Stop reverse proxies (nginx) from buffering the event stream
+                "X-Accel-Buffering": "no"
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in stream_run: {e}")
+        logger.exception("Error in stream_run")
         raise HTTPException(status_code=500, detail=str(e))
 
 # For local development
@@ -332,8 +376,14 @@ if __name__ == "__main__":
             reload_dirs=["./"]
         )
     else:
+        # Several workers only share threads through Redis, so default to one without it
+        default_workers = "4" if os.environ.get("REDIS_URL") else "1"
         uvicorn.run(
-            app, 
+            "production_app:app",  # Import string format required for multiple workers
             host="0.0.0.0", 
-            port=port
+            port=port,
+            workers=int(os.environ.get("WEB_CONCURRENCY", default_workers)),
+            # uvloop is POSIX-only; Windows keeps the selector loop policy set above
+            loop="asyncio" if sys.platform == "win32" else "uvloop",
+            http="httptools"
         )
\ No newline at end of file
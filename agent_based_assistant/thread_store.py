@@ -0,0 +1,112 @@
+# Thread state storage for the production API
+# Purpose: Keep per-thread conversation state outside the request handlers, with optimistic concurrency
+
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+from config.settings import app_config
+
+# Atomically replace a thread's state only if its stored version still matches the expected one
+REDIS_CAS_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'version')
+if current and tonumber(current) ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[2], 'data', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+class StateConflictError(Exception):
+    """Raised when a thread was updated by another request since it was read"""
+
+
+class MemoryThreadStore:
+    """
+    In-process thread store (single worker). get() returns a copy, so a
+    request only changes the stored state through put(). Threads expire after
+    ttl seconds and the least recently used are evicted beyond max_threads.
+    """
+
+    def __init__(self, ttl: int, max_threads: int):
+        self.ttl = ttl
+        self.max_threads = max_threads
+        # thread_id -> (stored_at, state), least recently used first
+        self.states: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    async def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        state = self._live_state(thread_id)
+        if state is None:
+            return None
+        self.states.move_to_end(thread_id)
+        return {**state, "messages": list(state.get("messages") or ())}
+
+    async def put(self, thread_id: str, state: Dict[str, Any], expected_version: int) -> None:
+        """Store state as version expected_version + 1, or raise StateConflictError"""
+        current = self._live_state(thread_id)
+        if current is not None and current.get("state_version") != expected_version:
+            raise StateConflictError(f"Thread {thread_id} was modified concurrently")
+        self.states[thread_id] = (time.monotonic(), {**state, "state_version": expected_version + 1})
+        self.states.move_to_end(thread_id)
+        while len(self.states) > self.max_threads:
+            self.states.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def _live_state(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Stored state, dropping it if it has expired"""
+        entry = self.states.get(thread_id)
+        if entry is None:
+            return None
+        stored_at, state = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            del self.states[thread_id]
+            return None
+        return state
+
+
+class RedisThreadStore:
+    """
+    Redis-backed thread store shared by all workers. Messages are stored as
+    plain dicts (no pickle) and each thread expires after session_timeout.
+    """
+
+    def __init__(self, url: str, ttl: int):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.ttl = ttl
+        self.cas = self.redis.register_script(REDIS_CAS_SCRIPT)
+
+    async def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        data = await self.redis.hget(f"thread:{thread_id}", "data")
+        if data is None:
+            return None
+        state = json.loads(data)
+        state["messages"] = messages_from_dict(state.get("messages") or [])
+        return state
+
+    async def put(self, thread_id: str, state: Dict[str, Any], expected_version: int) -> None:
+        """Store state as version expected_version + 1, or raise StateConflictError"""
+        new_version = expected_version + 1
+        data = json.dumps(
+            {**state, "messages": messages_to_dict(state.get("messages") or []), "state_version": new_version},
+            default=str
+        )
+        stored = await self.cas(keys=[f"thread:{thread_id}"], args=[expected_version, new_version, data, self.ttl])
+        if not stored:
+            raise StateConflictError(f"Thread {thread_id} was modified concurrently")
+
+
+def create_thread_store():
+    """Use Redis when REDIS_URL is set (multi-worker deployments), otherwise keep state in process"""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return RedisThreadStore(redis_url, app_config.session_timeout)
+    return MemoryThreadStore(app_config.session_timeout, app_config.max_sessions)
@@ -1,15 +1,25 @@
 # Basic application information collection tool
 # Purpose: Collect initial visa application data (country, purpose, dates, travelers)
 
+import re
 from typing import Any, Dict, Optional
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage
 from agent.state import AgentState, create_error_record
-from config.settings import invoke_llm_safe
+from config.settings import ainvoke_llm_safe
+
+# "Label: value" lines in the extraction response, mapped to state keys
+EXTRACTED_FIELD_PATTERN = re.compile(r'^(Country|Purpose|Travelers|Dates):[ \t]*(\S.*?)[ \t\r]*$', re.MULTILINE)
+EXTRACTED_FIELD_KEYS = {
+    "Country": "country",
+    "Purpose": "purpose_of_travel",
+    "Travelers": "number_of_travelers",
+    "Dates": "travel_dates"
+}
 
 
 @tool
-def base_information_collector_tool(user_message: str) -> str:
+async def base_information_collector_tool(user_message: str) -> str:
     """
     Collect basic visa application information: country, purpose, travel dates, number of travelers.
     
@@ -28,7 +38,7 @@ def base_information_collector_tool(user_message: str) -> str:
     
     try:
         # Extract information from user message
-        extracted_info = _extract_basic_visa_info_simple(user_message)
+        extracted_info = await _extract_basic_visa_info_simple(user_message)
         
         # Check what information is still missing
         missing_fields = _get_missing_basic_fields(extracted_info)
@@ -44,7 +54,7 @@ def base_information_collector_tool(user_message: str) -> str:
         return "I'm having difficulty processing your application details. Could you please tell me which country you want to visit and what is your purpose of travel?"
 
 
-def _extract_basic_visa_info_simple(user_message: str) -> dict:
+async def _extract_basic_visa_info_simple(user_message: str) -> dict:
     """Extract basic visa information from user message using simple LLM"""
     try:
         extraction_prompt = f"""Extract visa application information from this user message: "{user_message}"
@@ -63,36 +73,21 @@ Dates: [dates or "not mentioned"]
 
 Only extract what is explicitly stated, do not assume or guess."""
 
-        response = invoke_llm_safe([HumanMessage(content=extraction_prompt)])
+        response = await ainvoke_llm_safe([HumanMessage(content=extraction_prompt)])
         content = response.content.strip()
         
-        # Parse the simple response format
+        # Parse the simple response format in one regex pass
         result = {}
-        lines = content.split('\n')
-        
-        for line in lines:
-            if line.startswith('Country:'):
-                country = line.replace('Country:', '').strip()
-                if country != "not mentioned":
-                    result["country"] = country
-                    
-            elif line.startswith('Purpose:'):
-                purpose = line.replace('Purpose:', '').strip()
-                if purpose != "not mentioned":
-                    result["purpose_of_travel"] = purpose
-                    
-            elif line.startswith('Travelers:'):
-                travelers = line.replace('Travelers:', '').strip()
-                if travelers != "not mentioned":
-                    try:
-                        result["number_of_travelers"] = int(travelers)
-                    except:
-                        pass
-                        
-            elif line.startswith('Dates:'):
-                dates = line.replace('Dates:', '').strip()
-                if dates != "not mentioned":
-                    result["travel_dates"] = dates
+        for match in EXTRACTED_FIELD_PATTERN.finditer(content):
+            label, value = match.groups()
+            if value == "not mentioned":
+                continue
+            if label == "Travelers":
+                try:
+                    value = int(value)
+                except ValueError:
+                    continue
+            result[EXTRACTED_FIELD_KEYS[label]] = value
         
         return result
         
@@ -103,23 +98,16 @@ Only extract what is explicitly stated, do not assume or guess."""
 # OLD PYDANTIC-BASED FUNCTION (REMOVED FOR LANGRAPH COMPATIBILITY)
 
 
-def _get_missing_basic_fields(info: dict) -> list[str]:
+# Basic fields collected before visa type analysis
+BASIC_FIELDS = ("country", "purpose_of_travel", "number_of_travelers", "travel_dates")
+
+
+def _get_missing_basic_fields(info: dict) -> frozenset[str]:
     """Determine which basic fields are still missing"""
-    missing = []
-    
-    if not info.get("country"):
-        missing.append("country")
-    if not info.get("purpose_of_travel"):
-        missing.append("purpose_of_travel")
-    if not info.get("number_of_travelers"):
-        missing.append("number_of_travelers")
-    if not info.get("travel_dates"):
-        missing.append("travel_dates")
-        
-    return missing
+    return frozenset(field for field in BASIC_FIELDS if not info.get(field))
 
 
-def _generate_missing_info_question(missing_fields: list[str], current_info: dict) -> str:
+def _generate_missing_info_question(missing_fields: frozenset[str], current_info: dict) -> str:
     """Generate short, crisp question for missing basic information"""
     
     if not missing_fields:
@@ -3,12 +3,15 @@ from typing import Any, Dict
 from langchain_core.tools import tool
 from agent.state import AgentState
 
+# Static reply shared by every call (never mutated)
+DETAILED_REPLY = {
+    "response": "Detailed application tool is not implemented yet.",
+    "last_tool_used": "application_detailed"
+}
+
 @tool
 def application_detailed_tool(user_message: str, state: AgentState) -> Dict[str, Any]:
     """Placeholder tool for detailed application collection"""
-    return {
-        "response": "Detailed application tool is not implemented yet.",
-        "last_tool_used": "application_detailed"
-    }
+    return DETAILED_REPLY
 
 __all__ = ["application_detailed_tool"]
\ No newline at end of file
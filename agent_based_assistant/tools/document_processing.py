@@ -3,12 +3,15 @@ from typing import Any, Dict
 from langchain_core.tools import tool
 from agent.state import AgentState
 
+# Static reply shared by every call (never mutated)
+DOCUMENT_REPLY = {
+    "response": "Document processing tool is not implemented yet.",
+    "last_tool_used": "document_processing"
+}
+
 @tool
 def document_processing_tool(user_message: str, state: AgentState) -> Dict[str, Any]:
     """Placeholder tool for document processing"""
-    return {
-        "response": "Document processing tool is not implemented yet.",
-        "last_tool_used": "document_processing"
-    }
+    return DOCUMENT_REPLY
 
 __all__ = ["document_processing_tool"]
\ No newline at end of file
@@ -2,12 +2,30 @@
 # Purpose: Handle user greetings and introductions
 
 import os
+import re
 from typing import Any, Dict
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage
 from langchain_groq import ChatGroq
 from agent.state import AgentState
 
+# Substring keyword sets compiled into single alternations
+OFF_TOPIC_PATTERN = re.compile("|".join([
+    "weather", "sports", "movies", "music", "food", "cooking", "games", 
+    "programming", "code", "technology", "politics", "news", "stocks",
+    "health", "medicine", "dating", "relationships", "jokes", "funny",
+    "shopping", "fashion", "cars", "driving", "pets", "animals"
+]))
+VISA_CONTEXT_PATTERN = re.compile("visa|travel|passport|country|application")
+
+# Greeting keywords matched as whole words (so "hi" no longer matches "this");
+# multi-word phrases are still substring checks
+WORD_PATTERN = re.compile(r"[a-z]+")
+GREETING_WORDS = frozenset({"hi", "hello", "hey"})
+GREETING_PHRASES = ("good morning", "good afternoon", "good evening")
+THANKS_WORDS = frozenset({"thank", "thanks", "thankyou", "appreciate", "appreciated"})
+FAREWELL_WORDS = frozenset({"bye", "goodbye", "farewell"})
+
 
 @tool
 def greetings_tool(user_message: str) -> str:
@@ -38,16 +56,18 @@ def _generate_greeting_response(user_message: str) -> str:
     
     message_lower = user_message.lower().strip()
     
+    words = frozenset(WORD_PATTERN.findall(message_lower))
+    
     # Handle different types of greetings
-    if any(greeting in message_lower for greeting in ["hi", "hello", "hey", "good morning", "good afternoon", "good evening"]):
+    if words & GREETING_WORDS or any(phrase in message_lower for phrase in GREETING_PHRASES):
         return "Hello! I'm Veazy, your VISA Genie assistant. I'm here to help you with visa information and applications.\n\n1. I can answer any visa-related queries\n2. I can complete your entire visa application on your behalf\n\nWhat can I assist you with today?"
     
     # Handle thanks/appreciation
-    elif any(thanks in message_lower for thanks in ["thank", "thanks", "appreciate"]):
+    elif words & THANKS_WORDS:
         return "You're welcome! Feel free to ask me anything about visa requirements, applications, or if you'd like to start a new application."
     
     # Handle farewell
-    elif any(bye in message_lower for bye in ["bye", "goodbye", "see you", "farewell"]):
+    elif words & FAREWELL_WORDS or "see you" in message_lower:
         return "Goodbye! Feel free to return anytime if you need help with visa information or applications. Have a great day!"
     
     # Handle off-topic questions
@@ -65,19 +85,8 @@ def _generate_greeting_response(user_message: str) -> str:
 
 def _is_off_topic(message_lower: str) -> bool:
     """Detect if message is off-topic from visa assistance"""
-    
-    off_topic_indicators = [
-        "weather", "sports", "movies", "music", "food", "cooking", "games", 
-        "programming", "code", "technology", "politics", "news", "stocks",
-        "health", "medicine", "dating", "relationships", "jokes", "funny",
-        "shopping", "fashion", "cars", "driving", "pets", "animals"
-    ]
-    
-    # Check if message contains off-topic keywords without visa context
-    has_off_topic = any(indicator in message_lower for indicator in off_topic_indicators)
-    has_visa_context = any(visa_word in message_lower for visa_word in ["visa", "travel", "passport", "country", "application"])
-    
-    return has_off_topic and not has_visa_context
+    # Contains off-topic keywords without visa context (one regex scan each)
+    return OFF_TOPIC_PATTERN.search(message_lower) is not None and VISA_CONTEXT_PATTERN.search(message_lower) is None
 
 
 # Export the tool for agent use
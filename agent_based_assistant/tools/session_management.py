@@ -3,12 +3,15 @@ from typing import Any, Dict
 from langchain_core.tools import tool
 from agent.state import AgentState
 
+# Static reply shared by every call (never mutated)
+SESSION_REPLY = {
+    "response": "Session management tool is not implemented yet.",
+    "last_tool_used": "session_management"
+}
+
 @tool
 def session_management_tool(user_message: str, state: AgentState) -> Dict[str, Any]:
     """Placeholder tool for session management"""
-    return {
-        "response": "Session management tool is not implemented yet.",
-        "last_tool_used": "session_management"
-    }
+    return SESSION_REPLY
 
 __all__ = ["session_management_tool"]
\ No newline at end of file
@@ -1,18 +1,28 @@
 # Visa information tool for agent
 # Purpose: Provide visa requirements, policies, and general country information
 
-import json
-import os
-import pprint
-from typing import Any, Dict, Optional
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+import orjson
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage
 from agent.state import AgentState
-from config.settings import invoke_llm_safe
+from config.settings import ainvoke_llm_safe, app_config
+
+# Knowledge base location, relative to the current directory (agent_based_assistant)
+KNOWLEDGE_BASE_DIR = Path("knowledge_base")
+
+# Process-wide LRU of loaded knowledge bases: country -> (loaded_at, visa_info, llm_context)
+VISA_INFO_CACHE_SIZE = 256
+VISA_INFO_CACHE: "OrderedDict[str, tuple[float, dict, str]]" = OrderedDict()
 
 
 @tool
-def general_enquiry_tool(user_message: str) -> str:
+async def general_enquiry_tool(user_message: str) -> str:
     """
     Provide visa information, requirements, and policies for specific countries.
     
@@ -30,21 +40,21 @@ def general_enquiry_tool(user_message: str) -> str:
     """
     
     try:
-        # Extract country from user query
-        country = _extract_country_from_query(user_message)
+        # Match a country we have knowledge for directly; only ask the LLM when that is ambiguous
+        country = _match_known_country(user_message) or await _extract_country_from_query(user_message)
         
         # If still no country, ask for clarification
         if not country:
             return "I'd be happy to help with visa information! Could you please specify which country's visa you're asking about?"
         
         # Load and process visa information
-        visa_info = _load_visa_knowledge(country)
+        visa_info, context = _load_visa_knowledge(country)
         
         if not visa_info:
             return f"I don't have detailed visa information for {country.title()} available at the moment. Please contact our support team for the most current information."
         
         # Generate response using LLM with visa knowledge
-        response = _generate_visa_response(user_message, visa_info)
+        response = await _generate_visa_response(user_message, context)
         
         return response
         
@@ -52,7 +62,30 @@ def general_enquiry_tool(user_message: str) -> str:
         return "I'm having some technical difficulties right now. Please try your question again, or feel free to contact our support team for assistance."
 
 
-def _extract_country_from_query(query: str) -> Optional[str]:
+# Same matching as nodes/general_enquiry.py (known_country_pattern / match_known_country) in the
+# node-based app; the two apps are run separately and cannot share the module, so keep them in step
+@lru_cache(maxsize=1)
+def _known_country_pattern() -> Optional["re.Pattern"]:
+    """Word-boundary regex over the countries present in the knowledge base (scanned once)"""
+    try:
+        countries = sorted(entry.name for entry in KNOWLEDGE_BASE_DIR.iterdir() if entry.is_dir())
+    except OSError:
+        return None
+    if not countries:
+        return None
+    return re.compile(r"\b(" + "|".join(map(re.escape, countries)) + r")\b", re.IGNORECASE)
+
+
+def _match_known_country(query: str) -> Optional[str]:
+    """The single knowledge-base country named in the query, or None if none or several are named"""
+    pattern = _known_country_pattern()
+    if pattern is None:
+        return None
+    mentioned = {match.lower() for match in pattern.findall(query)}
+    return mentioned.pop() if len(mentioned) == 1 else None
+
+
+async def _extract_country_from_query(query: str) -> Optional[str]:
     """Extract country name from user query using LLM"""
     try:
         extraction_prompt = f"""Extract the country name from this visa-related query. Return ONLY the country name in lowercase, single word format (e.g., 'vietnam', 'thailand', 'singapore').
@@ -63,7 +96,7 @@ If no specific country is mentioned, return 'none'.
 
 Response format: Just the country name, nothing else."""
         
-        response = invoke_llm_safe([HumanMessage(content=extraction_prompt)])
+        response = await ainvoke_llm_safe([HumanMessage(content=extraction_prompt)])
         country = response.content.strip().lower()
         
         # Simple validation - if it looks like a country name
@@ -76,22 +109,42 @@ Response format: Just the country name, nothing else."""
         return None
 
 
-def _load_visa_knowledge(country: str) -> dict:
-    """Load visa information from JSON knowledge base"""
+def _load_visa_knowledge(country: str) -> Tuple[dict, str]:
+    """
+    Load visa information and its formatted LLM context, served from a shared
+    LRU cache with a TTL of app_config.cache_ttl
+    """
     if not country:
-        return {}
+        return {}, _format_visa_info_for_llm({})
     
-    # Look for knowledge base in the current directory (agent_based_assistant)
-    knowledge_path = f"knowledge_base/{country}/visa_info.json"
+    if not app_config.enable_caching:
+        visa_info = _read_visa_knowledge(country)
+        return visa_info, _format_visa_info_for_llm(visa_info)
     
-    if os.path.exists(knowledge_path):
-        try:
-            with open(knowledge_path, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {}
+    now = time.monotonic()
+    cached = VISA_INFO_CACHE.get(country)
+    if cached is not None and now - cached[0] < app_config.cache_ttl:
+        VISA_INFO_CACHE.move_to_end(country)
+        return cached[1], cached[2]
     
-    return {}
+    visa_info = _read_visa_knowledge(country)
+    context = _format_visa_info_for_llm(visa_info)
+    VISA_INFO_CACHE[country] = (now, visa_info, context)
+    VISA_INFO_CACHE.move_to_end(country)
+    if len(VISA_INFO_CACHE) > VISA_INFO_CACHE_SIZE:
+        VISA_INFO_CACHE.popitem(last=False)
+    return visa_info, context
+
+
+def _read_visa_knowledge(country: str) -> dict:
+    """Load visa information from JSON knowledge base"""
+    # Look for knowledge base in the current directory (agent_based_assistant)
+    knowledge_path = KNOWLEDGE_BASE_DIR / country / "visa_info.json"
+    
+    try:
+        return orjson.loads(knowledge_path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
 
 
 def _format_visa_info_for_llm(visa_info: dict) -> str:
@@ -99,17 +152,15 @@ def _format_visa_info_for_llm(visa_info: dict) -> str:
     if not visa_info:
         return "No specific visa information available."
     
-    # Use pprint to format the entire JSON in a readable way
-    formatted_json = pprint.pformat(visa_info, indent=2, width=100, depth=None)
+    # Indented JSON is readable for the LLM and uses fewer tokens than a pprint repr
+    formatted_json = orjson.dumps(visa_info, option=orjson.OPT_INDENT_2).decode()
     
     return f"COMPLETE VISA KNOWLEDGE BASE:\n{formatted_json}"
 
 
-def _generate_visa_response(user_message: str, visa_info: dict) -> str:
-    """Generate structured visa response using LLM and knowledge base"""
+async def _generate_visa_response(user_message: str, context: str) -> str:
+    """Generate structured visa response using LLM and the formatted knowledge base context"""
     try:
-        context = _format_visa_info_for_llm(visa_info)
-        
         prompt = f"""You are a professional visa assistant. Answer the user's question based ONLY on the provided visa information context.
 
 CONTEXT:
@@ -144,7 +195,7 @@ For any question related to visa, you need to answer like a Highly experienced V
 
 Return ONLY the answer text, no JSON formatting."""
         
-        response = invoke_llm_safe([HumanMessage(content=prompt)])
+        response = await ainvoke_llm_safe([HumanMessage(content=prompt)])
         return response.content.strip()
         
     except Exception as e:
@@ -2,14 +2,17 @@
 # Purpose: Analyze travel details and recommend appropriate visa type
 
 import os
+from functools import lru_cache
 from typing import Any
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage
 from langchain_groq import ChatGroq
+from config.settings import NOSTREAM_TAG
 
 
+@lru_cache(maxsize=1)
 def _get_groq_llm():
-    """Initialize Groq LLM for visa type analysis"""
+    """Initialize Groq LLM for visa type analysis (once per process, keeping its HTTP pool warm)"""
     try:
         api_key = os.getenv("GROQ_API_KEY")
         if not api_key:
@@ -28,7 +31,7 @@ def _get_groq_llm():
 
 
 @tool
-def visa_type_analyzer_tool(country: str, purpose: str, travelers: int, travel_dates: str) -> str:
+async def visa_type_analyzer_tool(country: str, purpose: str, travelers: int, travel_dates: str) -> str:
     """
     Analyze travel details and recommend the most appropriate visa type using Groq API.
     
@@ -72,7 +75,7 @@ def visa_type_analyzer_tool(country: str, purpose: str, travelers: int, travel_d
 Keep response concise and practical. Focus on the most suitable single recommendation."""
 
         # Call Groq API
-        response = groq_llm.invoke([HumanMessage(content=prompt)])
+        response = await groq_llm.ainvoke([HumanMessage(content=prompt)], config={"tags": [NOSTREAM_TAG]})
         
         if response and response.content:
             return response.content.strip()
@@ -1,6 +1,14 @@
 from langchain.chat_models import init_chat_model
+from langchain_core.caches import InMemoryCache
+from langchain_core.globals import set_llm_cache
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Identical prompt + model calls are answered from memory instead of the provider
+set_llm_cache(InMemoryCache(maxsize=1024))
+
+# Tag for LLM calls whose tokens are shown to the user as they are generated (all other calls stay internal)
+STREAM_TAG = "user_stream"
+
 llm = init_chat_model("anthropic:claude-sonnet-4-20250514", max_tokens=8192, temperature=0)
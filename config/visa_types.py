@@ -1,13 +1,22 @@
-VISA_TYPES = {
-    "tourist": ["single_entry", "multiple_entry"],
-    "business": ["single_entry", "multiple_entry"], 
-    "transit": ["single_entry"],
-    "student": ["single_entry"],
-    "work": ["single_entry", "multiple_entry"]
-}
+from types import MappingProxyType
 
-# Combined visa types for user selection
-COMBINED_VISA_TYPES = []
-for visa_category, entry_types in VISA_TYPES.items():
-    for entry_type in entry_types:
-        COMBINED_VISA_TYPES.append(f"{visa_category}_{entry_type}")
+VISA_TYPES = MappingProxyType({
+    "tourist": ("single_entry", "multiple_entry"),
+    "business": ("single_entry", "multiple_entry"), 
+    "transit": ("single_entry",),
+    "student": ("single_entry",),
+    "work": ("single_entry", "multiple_entry")
+})
+
+# Combined visa types for user selection (kept in sync with VISA_TYPES)
+COMBINED_VISA_TYPES = (
+    "tourist_single_entry",
+    "tourist_multiple_entry",
+    "business_single_entry",
+    "business_multiple_entry",
+    "transit_single_entry",
+    "student_single_entry",
+    "work_single_entry",
+    "work_multiple_entry"
+)
+COMBINED_VISA_TYPE_SET = frozenset(COMBINED_VISA_TYPES)
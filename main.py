@@ -1,28 +1,56 @@
+import asyncio
 from graph.builder import build_graph
-from langchain_core.messages import HumanMessage
+from config.settings import STREAM_TAG
+from langchain_core.messages import AIMessage, HumanMessage
 
-def main():
+# Messages kept between turns; nodes only read the latest turns, so older history is dropped
+MAX_HISTORY_MESSAGES = 40
+
+async def amain():
     app = build_graph()
     state = {"messages": []}
 
     while True:
-        user_input = input("User: ")
+        # Read input off the event loop thread so the loop stays free for other sessions
+        user_input = await asyncio.to_thread(input, "User: ")
         
         # Add user message to state using proper LangChain message object
         previous_message_count = len(state["messages"])
         state["messages"].append(HumanMessage(content=user_input))
+        state["last_human_idx"] = previous_message_count
         
-        # Invoke the app with the accumulated state
-        agent_answer = app.invoke(state)
-        
-        # Show all new assistant messages since the last user input
-        new_messages = agent_answer["messages"][previous_message_count + 1:]  # Skip user message + previous messages
-        for msg in new_messages:
-            if hasattr(msg, 'type') and msg.type == 'ai':
-                print("Assistant:", msg.content)
+        # Stream the run: print tokens of user-facing LLM calls as they arrive, print other
+        # assistant messages as soon as their node finishes, and keep the last full state snapshot
+        agent_answer = state
+        streamed_nodes = set()  # Nodes whose reply was already printed token by token
+        async for mode, payload in app.astream(state, stream_mode=["messages", "updates", "values"]):
+            if mode == "values":
+                agent_answer = payload
+            elif mode == "messages":
+                chunk, metadata = payload
+                if STREAM_TAG in metadata.get("tags", ()) and isinstance(chunk.content, str) and chunk.content:
+                    node = metadata["langgraph_node"]
+                    if node not in streamed_nodes:
+                        streamed_nodes.add(node)
+                        print("Assistant: ", end="")
+                    print(chunk.content, end="", flush=True)
+            else:
+                for node, update in payload.items():
+                    if node in streamed_nodes:
+                        streamed_nodes.discard(node)
+                        print(flush=True)
+                        continue
+                    for msg in (update or {}).get("messages", []):
+                        if isinstance(msg, AIMessage):
+                            print("Assistant:", msg.content, flush=True)
         
-        # Update state with the response
+        # Update state with the response, keeping only a sliding window of recent messages
         state = agent_answer
+        if len(state["messages"]) > MAX_HISTORY_MESSAGES:
+            state["messages"] = state["messages"][-MAX_HISTORY_MESSAGES:]
+
+def main():
+    asyncio.run(amain())
 
 if __name__ == "__main__":
     main()
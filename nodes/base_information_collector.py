@@ -1,24 +1,68 @@
-from state import State
+import re
+from state import State, latest_user_message
+from nodes.general_enquiry import match_known_country
 from config.settings import llm
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from pydantic import BaseModel, Field
+from langchain_core.messages import SystemMessage, AIMessage
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 
 class VisaInfo(BaseModel):
+    # Extraction results are read once and never modified
+    model_config = ConfigDict(frozen=True)
+    
     country: Optional[str] = Field(None, description="Country name (capitalized)")
     purpose_of_travel: Optional[str] = Field(None, description="Purpose of travel (e.g., tourism, business, work, study, transit)")
     number_of_travelers: Optional[int] = Field(None, description="Number of travelers as integer. Extract from phrases like '2 people', 'three persons', 'solo trip' (=1), 'me and my wife' (=2), 'family of 4' (=4)")
     travel_dates: Optional[str] = Field(None, description="Travel dates from and to in DD/MM/YY format. Convert any input to this standard format: '24 Jan to 3rd Feb 2026' → '24/01/26 to 03/02/26', 'January 24 to February 2, 2026' → '24/01/26 to 02/02/26'. If cannot convert (like 'next month'), keep original.")
 
+# Basic fields collected before moving to detailed collection
+BASIC_FIELDS = ("country", "purpose_of_travel", "number_of_travelers", "travel_dates")
+
+# Question asked for each missing basic field, in BASIC_FIELDS order
+MISSING_FIELD_QUESTIONS = {
+    "country": "Which country are you visiting?",
+    "purpose_of_travel": "What is your purpose of travel? (e.g., tourism, business, work, study, transit)",
+    "number_of_travelers": "How many travelers? (e.g., 1, 2, 3)",
+    "travel_dates": "What are your travel dates? (e.g., '24/01/26 to 02/02/26', '24 Jan to 2 Feb 2026')"
+}
+
+# Messages without a single letter or digit (e.g. "?", "...") cannot carry new information
+WORD_CHARACTER = re.compile(r"\w")
+
+# One-word replies that fill a single field without the LLM: a traveler count, a listed purpose,
+# or a country from the knowledge base
+TRAVELER_COUNT_PATTERN = re.compile(r"[1-9]\d?")
+TRAVEL_PURPOSES = frozenset({"tourism", "business", "work", "study", "transit"})
+
+# Structured output runnable, built once (modern LangGraph best practice)
+STRUCTURED_LLM = llm.with_structured_output(VisaInfo)
+
+# Extraction rules, marked for Anthropic prompt caching (identical on every call)
+EXTRACTION_RULES = """STRICT EXTRACTION RULES - Only extract if EXPLICITLY mentioned:
+- country: Only if a specific country name is mentioned
+- purpose_of_travel: Only if user explicitly mentions purpose (tourism, business, work, study, transit, etc.)
+- number_of_travelers: Convert to integer from phrases like "2 people", "three travelers", "solo trip" (=1), "me and my wife" (=2), "family of 4" (=4)
+- travel_dates: Travel dates from and to. Extract from formats like "24/01/26 to 02/02/26", "24 Jan to 2 Feb 2026", "from 15th March to 28th March", "next month", "in 2 weeks"
+
+DO NOT assume or guess. Set fields to null if not explicitly mentioned."""
+
+EXTRACTION_SYSTEM_MESSAGE = SystemMessage(content=[
+    {"type": "text", "text": EXTRACTION_RULES, "cache_control": {"type": "ephemeral"}}
+])
+
+# Static rules go first as a cached system block; only the user turn is filled in per call
+EXTRACTION_PROMPT = ChatPromptTemplate.from_messages([
+    EXTRACTION_SYSTEM_MESSAGE,
+    ("human", 'Extract visa information from this user message: "{user_message}"\n\nCurrent information we already have: {current_initial_info}')
+])
+EXTRACTION_CHAIN = EXTRACTION_PROMPT | STRUCTURED_LLM
+
 def base_information_collector(state: State) -> dict:
     current_initial_info = state.get("initial_info", {})
     
     # Get the latest USER message (filter by message type)
-    user_message = ""
-    for msg in reversed(state["messages"]):
-        if hasattr(msg, 'type') and msg.type == 'human':
-            user_message = msg.content
-            break
+    user_message = latest_user_message(state)
     
     # Handle empty or whitespace-only messages
     if not user_message or not user_message.strip():
@@ -29,16 +73,36 @@ def base_information_collector(state: State) -> dict:
     
     # CASE 1: Direct answer - user answered our specific question
     if state.get("user_answer_category") == "answer":
-        return handle_direct_answer(user_message, current_initial_info, state)
+        result = handle_direct_answer(user_message, current_initial_info, state)
     
     # CASE 2: Restored state from collection_resume (returning from general enquiry)
     elif state.get("collection_in_progress") and not state.get("user_answer_category"):
-        return handle_restored_collection(current_initial_info, state)
+        result = handle_restored_collection(current_initial_info, state)
     
     # CASE 3: Initial collection (first time from visa_application or fresh start)
     else:
-        return handle_initial_collection(user_message, current_initial_info, state)
+        result = handle_initial_collection(user_message, current_initial_info, state)
+    
+    # intent_analyser's extraction only stands in for this turn's message; a later identical
+    # message (e.g. re-sent after a failed extraction reset initial_info) must be extracted again
+    result["intent_extracted_message"] = None
+    return result
     
+def numbered_questions(missing_fields: list) -> str:
+    """Numbered list of the questions for the given missing fields"""
+    return "\n".join(f"{i+1}. {MISSING_FIELD_QUESTIONS[field]}" for i, field in enumerate(missing_fields))
+
+def quick_extract(user_message: str) -> Optional[dict]:
+    """Field read directly from a one-word reply; None means the LLM has to extract"""
+    reply = user_message.strip().rstrip(".!").lower()
+    if TRAVELER_COUNT_PATTERN.fullmatch(reply):
+        return {"number_of_travelers": int(reply)}
+    if reply in TRAVEL_PURPOSES:
+        return {"purpose_of_travel": reply}
+    if match_known_country(reply) == reply:
+        return {"country": reply.title()}
+    return None
+
 def handle_direct_answer(user_message: str, current_initial_info: dict, state: State) -> dict:
     """Handle when user directly answered our question (user_answer_category='answer')"""
     return extract_and_process_info(user_message, current_initial_info, state)
@@ -52,15 +116,7 @@ def handle_restored_collection(current_initial_info: dict, state: State) -> dict
     }
     
     # Check what's still missing and ask for it
-    missing_fields = []
-    if not current_initial_info.get("country"):
-        missing_fields.append("country")
-    if not current_initial_info.get("purpose_of_travel"):
-        missing_fields.append("purpose_of_travel")
-    if not current_initial_info.get("number_of_travelers"):
-        missing_fields.append("number_of_travelers")
-    if not current_initial_info.get("travel_dates"):
-        missing_fields.append("travel_dates")
+    missing_fields = [field for field in BASIC_FIELDS if not current_initial_info.get(field)]
     
     if not missing_fields:
         # All info collected, proceed
@@ -72,17 +128,7 @@ def handle_restored_collection(current_initial_info: dict, state: State) -> dict
         })
     else:
         # Ask for missing fields
-        question_parts = []
-        if "country" in missing_fields:
-            question_parts.append("Which country are you visiting?")
-        if "purpose_of_travel" in missing_fields:
-            question_parts.append("What is your purpose of travel? (e.g., tourism, business, work, study, transit)")
-        if "number_of_travelers" in missing_fields:
-            question_parts.append("How many travelers? (e.g., 1, 2, 3)")
-        if "travel_dates" in missing_fields:
-            question_parts.append("What are your travel dates? (e.g., '24/01/26 to 02/02/26', '24 Jan to 2 Feb 2026')")
-        
-        question = "Let's continue with your visa application. " + "\n".join([f"{i+1}. {q}" for i, q in enumerate(question_parts)])
+        question = "Let's continue with your visa application. " + numbered_questions(missing_fields)
         question += "\n\nPlease provide the missing information."
         
         result.update({
@@ -99,39 +145,25 @@ def handle_initial_collection(user_message: str, current_initial_info: dict, sta
 
 def extract_and_process_info(user_message: str, current_initial_info: dict, state: State) -> dict:
     """Core extraction and processing logic"""
-    # Use structured output method (modern LangGraph best practice)
-    structured_llm = llm.with_structured_output(VisaInfo)
+    # Nothing left to extract, or nothing extractable in the message: skip the LLM round-trip
+    if all(current_initial_info.get(field) for field in BASIC_FIELDS) or not WORD_CHARACTER.search(user_message):
+        return build_collection_result(current_initial_info, info_changed=False)
     
-    extraction_prompt = f"""
-    Extract visa information from this user message: "{user_message}"
+    # intent_analyser already extracted this message's fields (into initial_info) while classifying it
+    if state.get("intent_extracted_message") == user_message:
+        return build_collection_result(current_initial_info, info_changed=False)
     
-    Current information we already have: {current_initial_info}
-    
-    STRICT EXTRACTION RULES - Only extract if EXPLICITLY mentioned:
-    - country: Only if a specific country name is mentioned
-    - purpose_of_travel: Only if user explicitly mentions purpose (tourism, business, work, study, transit, etc.)
-    - number_of_travelers: Convert to integer from phrases like "2 people", "three travelers", "solo trip" (=1), "me and my wife" (=2), "family of 4" (=4)
-    - travel_dates: Travel dates from and to. Extract from formats like "24/01/26 to 02/02/26", "24 Jan to 2 Feb 2026", "from 15th March to 28th March", "next month", "in 2 weeks"
-    
-    DO NOT assume or guess. Set fields to null if not explicitly mentioned.
-    """
+    # A one-word answer to a question we asked (the field is still missing) needs no LLM
+    quick_diff = quick_extract(user_message)
+    if quick_diff and not any(current_initial_info.get(field) for field in quick_diff):
+        return build_collection_result({**current_initial_info, **quick_diff})
     
     try:
-        extracted_data = structured_llm.invoke([HumanMessage(content=extraction_prompt)])
+        extracted_data = EXTRACTION_CHAIN.invoke({"user_message": user_message, "current_initial_info": current_initial_info})
         
-        # Merge with current info
-        extracted_info = current_initial_info.copy()
-        if extracted_data.country:
-            extracted_info["country"] = extracted_data.country
-        if extracted_data.purpose_of_travel:
-            extracted_info["purpose_of_travel"] = extracted_data.purpose_of_travel
-        if extracted_data.number_of_travelers:
-            extracted_info["number_of_travelers"] = extracted_data.number_of_travelers
-        if extracted_data.travel_dates:
-            extracted_info["travel_dates"] = extracted_data.travel_dates
-        
-        # Reset retry counter on successful extraction
-        return_data = {"extraction_retry_count": 0, "user_answer_category": None}
+        # Merge only newly extracted fields with current info (empty strings and 0 count as not extracted)
+        diff = {field: value for field, value in extracted_data.model_dump(exclude_none=True).items() if value}
+        extracted_info = {**current_initial_info, **diff} if diff else current_initial_info
             
     except Exception as e:
         # Check retry count to prevent infinite loops
@@ -153,50 +185,41 @@ def extract_and_process_info(user_message: str, current_initial_info: dict, stat
                 "awaiting_user_response": True,
                 "user_answer_category": None
             }
-    else:
-        # Only set return_data if no exception occurred
-        return_data = {"extraction_retry_count": 0, "user_answer_category": None}
     
+    return build_collection_result(extracted_info, info_changed=bool(diff))
+
+def build_collection_result(extracted_info: dict, info_changed: bool = True) -> dict:
+    """
+    Proceed when all basic fields are known, otherwise ask for the missing ones.
+    Always resets the retry counter and answer category (extraction succeeded).
+    initial_info is only written when it changed, so checkpoints skip the unchanged value.
+    """
     # Check what's still missing
-    missing_fields = []
-    if not extracted_info.get("country"):
-        missing_fields.append("country")
-    if not extracted_info.get("purpose_of_travel"):
-        missing_fields.append("purpose_of_travel")
-    if not extracted_info.get("number_of_travelers"):
-        missing_fields.append("number_of_travelers")
-    if not extracted_info.get("travel_dates"):
-        missing_fields.append("travel_dates")
+    missing_fields = [field for field in BASIC_FIELDS if not extracted_info.get(field)]
     
     # If all information is collected, proceed to next node
     if not missing_fields:
         result = {
             "messages": [AIMessage(content=f"Perfect! I have all the required information:\n- Country: {extracted_info['country']}\n- Purpose of Travel: {extracted_info['purpose_of_travel']}\n- Number of Travelers: {extracted_info['number_of_travelers']}\n- Travel Dates: {extracted_info['travel_dates']}\n\nLet me proceed to collect detailed information.")],
-            "initial_info": extracted_info,
             "awaiting_user_response": False,
-            "next": "detailed_collector"
+            "next": "detailed_collector",
+            "extraction_retry_count": 0,
+            "user_answer_category": None
         }
-        result.update(return_data)
+        if info_changed:
+            result["initial_info"] = extracted_info
         return result
     
     # Ask for all missing information in one message
-    question_parts = []
-    if "country" in missing_fields:
-        question_parts.append("Which country are you visiting?")
-    if "purpose_of_travel" in missing_fields:
-        question_parts.append("What is your purpose of travel? (e.g., tourism, business, work, study, transit)")
-    if "number_of_travelers" in missing_fields:
-        question_parts.append("How many travelers? (e.g., 1, 2, 3)")
-    if "travel_dates" in missing_fields:
-        question_parts.append("What are your travel dates? (e.g., '24/01/26 to 02/02/26', '24 Jan to 2 Feb 2026')")
-    
-    question = "I need a few more details:\n\n" + "\n".join([f"{i+1}. {q}" for i, q in enumerate(question_parts)])
+    question = "I need a few more details:\n\n" + numbered_questions(missing_fields)
     question += "\n\nPlease provide all the missing information in your response."
     
     result = {
         "messages": [AIMessage(content=question)],
-        "initial_info": extracted_info,
-        "awaiting_user_response": True
+        "awaiting_user_response": True,
+        "extraction_retry_count": 0,
+        "user_answer_category": None
     }
-    result.update(return_data)
+    if info_changed:
+        result["initial_info"] = extracted_info
     return result
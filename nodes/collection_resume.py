@@ -1,7 +1,84 @@
+import logging
+import re
+from typing import Optional
 from state import State
 from config.settings import llm
-from langchain_core.messages import HumanMessage, AIMessage
-from utils.file_manager import load_incomplete_application, delete_incomplete_application
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from utils.file_manager import aload_incomplete_application, adelete_incomplete_application
+
+logger = logging.getLogger(__name__)
+
+# Basic fields as (state key, label when missing, label in the progress summary), in asking order
+RESUME_FIELDS = (
+    ("country", "country", "Country"),
+    ("purpose_of_travel", "purpose of travel", "Purpose"),
+    ("number_of_travelers", "number of travelers", "Travelers"),
+    ("travel_dates", "travel dates", "Dates"),
+)
+MISSING_LABELS = {key: missing_label for key, missing_label, _ in RESUME_FIELDS}
+
+# Obvious replies classified without the LLM: reply -> (intent when asked to continue, intent when confirming a quit).
+# "yes" to "are you sure you want to quit?" means quit, so the intent depends on which question was asked
+AFFIRMATIVE_INTENTS = ("RESUME", "CONFIRMED_QUIT")
+NEGATIVE_INTENTS = ("DECLINE", "WANT_TO_CONTINUE")
+CONTINUE_INTENTS = ("RESUME", "WANT_TO_CONTINUE")
+QUIT_INTENTS = ("DECLINE", "CONFIRMED_QUIT")
+QUICK_RESUME_REPLIES = {
+    **dict.fromkeys(("yes", "y", "yeah", "yep", "ok", "okay", "sure"), AFFIRMATIVE_INTENTS),
+    **dict.fromkeys(("no", "n", "nope"), NEGATIVE_INTENTS),
+    **dict.fromkeys(("continue", "proceed", "resume", "go", "let's go", "lets go"), CONTINUE_INTENTS),
+    **dict.fromkeys(("cancel", "quit", "stop", "bye", "end", "exit"), QUIT_INTENTS),
+}
+
+# Static category definitions go in the system message; only the context and reply vary per call
+RESUME_CLASSIFIER_SYSTEM_MESSAGE = SystemMessage(content="""Classify the user's intent regarding their visa application into ONE category:
+
+1. RESUME - User wants to continue visa application
+   Examples: "yes", "continue", "proceed", "let's go", "okay"
+
+2. DECLINE - User wants to quit/cancel visa application  
+   Examples: "no", "cancel", "quit", "stop", "bye", "end", "I'm done"
+
+3. CONFIRMED_QUIT - User confirms they want to quit (after asking "are you sure?")
+   Examples: "yes quit", "I'm sure", "definitely no", "yes cancel"
+
+4. WANT_TO_CONTINUE - User changed mind, wants to continue (after decline)
+   Examples: "actually yes", "wait no", "let me continue", "I'll continue"
+
+5. UNCLEAR - Response is ambiguous or unclear
+   Examples: "maybe", "hmm", "what?", random text
+
+Respond with only the category name.""")
+
+# The reply is a single category name, so cap the output length
+RESUME_CLASSIFIER_LLM = llm.bind(max_tokens=10)
+
+# Re-prompts for handle_resume_decision, keyed by whether a quit confirmation is pending.
+# Replies are stored as text: AIMessage objects must not be shared, since add_messages assigns each one an id
+UNCLEAR_REPLIES = {
+    True: "Please say 'yes' to quit your application or 'no' to continue with your visa.",
+    False: "Please say 'yes' to continue your visa application or 'no' to quit."
+}
+FALLBACK_REPLIES = {
+    True: "Please say 'yes' to quit or 'no' to continue.",
+    False: "Please say 'yes' to continue or 'no' to quit."
+}
+
+QUIT_REPLY = "No problem! Your visa application has been cancelled. Feel free to start a new application or ask any visa-related questions."
+# Scalar fields reset on quit; the dict fields are created per call so no state shares them
+QUIT_STATE = {
+    "awaiting_user_response": False,
+    "collection_in_progress": False,
+    "confirmation_pending": False,
+    "user_answer_category": None,
+    "previous_node": None,
+    "incomplete_session_id": None,
+    "next": "intent_analyser"
+}
+
+# Phrases that only answer the quit confirmation question
+WANT_TO_CONTINUE_PATTERN = re.compile(r"\b(actually\s+yes|wait\s+no|let me continue|i'?ll continue)\b")
+CONFIRMED_QUIT_PATTERN = re.compile(r"\b(yes\s+(quit|cancel)|i'?m sure|definitely\s+no)\b")
 
 def collection_resume(state: State) -> dict:
     # Handle new context switching flow (from general_enquiry)
@@ -9,24 +86,7 @@ def collection_resume(state: State) -> dict:
         incomplete_info = state.get("incomplete_initial_info", {})
         
         # Determine what fields are still missing
-        missing_fields = []
-        if not incomplete_info.get("country"):
-            missing_fields.append("country")
-        if not incomplete_info.get("purpose_of_travel"):
-            missing_fields.append("purpose_of_travel")
-        if not incomplete_info.get("number_of_travelers"):
-            missing_fields.append("number_of_travelers")
-        if not incomplete_info.get("travel_dates"):
-            missing_fields.append("travel_dates")
-        
-        missing_labels = {
-            "country": "country",
-            "purpose_of_travel": "purpose of travel",
-            "number_of_travelers": "number of travelers",
-            "travel_dates": "travel dates"
-        }
-        
-        missing_items = [missing_labels.get(field, field) for field in missing_fields]
+        missing_items = [missing_label for key, missing_label, _ in RESUME_FIELDS if not incomplete_info.get(key)]
         missing_text = ", ".join(missing_items) if missing_items else "nothing more"
         
         # Preserve the previous message (general_enquiry answer) and append continuation
@@ -54,14 +114,7 @@ def collection_resume(state: State) -> dict:
         }
     
     missing_fields = state.get("missing_fields", [])
-    missing_labels = {
-        "country": "country",
-        "purpose_of_travel": "purpose of travel",
-        "number_of_travelers": "number of travelers",
-        "travel_dates": "travel dates"
-    }
-    
-    missing_items = [missing_labels.get(field, field) for field in missing_fields]
+    missing_items = [MISSING_LABELS.get(field, field) for field in missing_fields]
     missing_text = ", ".join(missing_items)
     
     message = f"I answered your question! Would you like to continue with your visa application? "
@@ -73,54 +126,46 @@ def collection_resume(state: State) -> dict:
         "next": "handle_resume_decision"
     }
 
-def classify_resume_response(user_message: str, context: str) -> str:
+def quick_resume_intent(user_message: str, confirmation_pending: bool) -> Optional[str]:
+    """Classify obvious replies locally; None means the LLM has to decide"""
+    reply = user_message.lower().strip().rstrip(".!")
+    intents = QUICK_RESUME_REPLIES.get(reply)
+    if intents:
+        return intents[confirmation_pending]
+    if confirmation_pending:
+        if CONFIRMED_QUIT_PATTERN.search(reply):
+            return "CONFIRMED_QUIT"
+        if WANT_TO_CONTINUE_PATTERN.search(reply):
+            return "WANT_TO_CONTINUE"
+    return None
+
+async def classify_resume_response(user_message: str, context: str, confirmation_pending: bool = False) -> str:
     """Use LLM to classify user's intent regarding visa application resume"""
+    intent = quick_resume_intent(user_message, confirmation_pending)
+    if intent:
+        return intent
+    
     try:
-        classification_prompt = f"""
-        CONTEXT: {context}
-        USER RESPONSE: "{user_message}"
-        
-        Classify the user's intent into ONE category:
-        
-        1. RESUME - User wants to continue visa application
-           Examples: "yes", "continue", "proceed", "let's go", "okay"
-        
-        2. DECLINE - User wants to quit/cancel visa application  
-           Examples: "no", "cancel", "quit", "stop", "bye", "end", "I'm done"
-        
-        3. CONFIRMED_QUIT - User confirms they want to quit (after asking "are you sure?")
-           Examples: "yes quit", "I'm sure", "definitely no", "yes cancel"
-        
-        4. WANT_TO_CONTINUE - User changed mind, wants to continue (after decline)
-           Examples: "actually yes", "wait no", "let me continue", "I'll continue"
-        
-        5. UNCLEAR - Response is ambiguous or unclear
-           Examples: "maybe", "hmm", "what?", random text
-        
-        Respond with only the category name.
-        """
-        
-        response = llm.invoke([HumanMessage(content=classification_prompt)])
+        response = await RESUME_CLASSIFIER_LLM.ainvoke([
+            RESUME_CLASSIFIER_SYSTEM_MESSAGE,
+            HumanMessage(content=f'CONTEXT: {context}\nUSER RESPONSE: "{user_message}"')
+        ])
         return response.content.strip().upper()
     except Exception as e:
-        print(f"Error in classify_resume_response: {e}")
+        logger.warning("Error in classify_resume_response: %s", e)
         return "UNCLEAR"
 
 def format_progress_summary(incomplete_info: dict) -> str:
     """Format user's progress for confirmation message"""
-    parts = []
-    if incomplete_info.get("country"):
-        parts.append(f"Country: {incomplete_info['country']}")
-    if incomplete_info.get("purpose_of_travel"):
-        parts.append(f"Purpose: {incomplete_info['purpose_of_travel']}")
-    if incomplete_info.get("number_of_travelers"):
-        parts.append(f"Travelers: {incomplete_info['number_of_travelers']}")
-    if incomplete_info.get("travel_dates"):
-        parts.append(f"Dates: {incomplete_info['travel_dates']}")
+    parts = [
+        f"{summary_label}: {value}"
+        for key, _, summary_label in RESUME_FIELDS
+        if (value := incomplete_info.get(key))
+    ]
     
     return ", ".join(parts) if parts else "some information collected"
 
-def handle_resume_decision(state: State) -> dict:
+async def handle_resume_decision(state: State) -> dict:
     user_message = state["messages"][-1].content
     incomplete_info = state.get("incomplete_initial_info", {})
     confirmation_pending = state.get("confirmation_pending", False)
@@ -132,11 +177,11 @@ def handle_resume_decision(state: State) -> dict:
     else:
         context = "I asked user if they want to continue their visa application"
     
-    # Classify user response using LLM
-    intent = classify_resume_response(user_message, context)
+    # Classify user response (obvious replies locally, the rest with the LLM)
+    intent = await classify_resume_response(user_message, context, confirmation_pending)
     
     if intent == "RESUME":
-        return resume_visa_application(state)
+        return await resume_visa_application(state)
     
     elif intent == "DECLINE" and not confirmation_pending:
         # First time decline - ask for confirmation
@@ -151,34 +196,22 @@ def handle_resume_decision(state: State) -> dict:
         return quit_visa_application()
     
     elif intent == "WANT_TO_CONTINUE" and confirmation_pending:
-        return resume_visa_application(state)
+        return await resume_visa_application(state)
     
     elif intent == "UNCLEAR":
-        if confirmation_pending:
-            return {
-                "messages": [AIMessage(content="Please say 'yes' to quit your application or 'no' to continue with your visa.")],
-                "next": "handle_resume_decision"
-            }
-        else:
-            return {
-                "messages": [AIMessage(content="Please say 'yes' to continue your visa application or 'no' to quit.")],
-                "next": "handle_resume_decision"
-            }
+        return {
+            "messages": [AIMessage(content=UNCLEAR_REPLIES[bool(confirmation_pending)])],
+            "next": "handle_resume_decision"
+        }
     
     else:
         # Fallback for any other cases
-        if confirmation_pending:
-            return {
-                "messages": [AIMessage(content="Please say 'yes' to quit or 'no' to continue.")],
-                "next": "handle_resume_decision"
-            }
-        else:
-            return {
-                "messages": [AIMessage(content="Please say 'yes' to continue or 'no' to quit.")],
-                "next": "handle_resume_decision"
-            }
+        return {
+            "messages": [AIMessage(content=FALLBACK_REPLIES[bool(confirmation_pending)])],
+            "next": "handle_resume_decision"
+        }
 
-def resume_visa_application(state: State) -> dict:
+async def resume_visa_application(state: State) -> dict:
     """Resume the visa application with saved state"""
     # Handle context switching resume
     if state.get("incomplete_initial_info"):
@@ -194,7 +227,7 @@ def resume_visa_application(state: State) -> dict:
     # Legacy session-based resume
     session_id = state.get("incomplete_session_id")
     if session_id:
-        incomplete_data = load_incomplete_application(session_id)
+        incomplete_data = await aload_incomplete_application(session_id)
         if incomplete_data:
             collected_data = incomplete_data.get("collected_data", {})
             updates = {
@@ -209,7 +242,7 @@ def resume_visa_application(state: State) -> dict:
                 if value:
                     updates[key] = value
             
-            delete_incomplete_application(session_id)
+            await adelete_incomplete_application(session_id)
             return updates
     
     # Fallback
@@ -223,14 +256,8 @@ def resume_visa_application(state: State) -> dict:
 def quit_visa_application() -> dict:
     """Clear all state and start fresh"""
     return {
-        "messages": [AIMessage(content="No problem! Your visa application has been cancelled. Feel free to start a new application or ask any visa-related questions.")],
-        "awaiting_user_response": False,
+        **QUIT_STATE,
+        "messages": [AIMessage(content=QUIT_REPLY)],
         "initial_info": {},
-        "collection_in_progress": False,
-        "incomplete_initial_info": {},
-        "confirmation_pending": False,
-        "user_answer_category": None,
-        "previous_node": None,
-        "incomplete_session_id": None,
-        "next": "intent_analyser"
+        "incomplete_initial_info": {}
     }
@@ -1,21 +1,32 @@
+from collections import ChainMap
 from state import State
 from langchain_core.messages import AIMessage
 import json
 
+# Summary shown after basic collection; fields missing from initial_info fall back to DETAILED_DEFAULTS
+DETAILED_MESSAGE_TEMPLATE = """Here's what I collected from the initial information gathering:
+
+**Country**: {country}
+**Purpose of Travel**: {purpose_of_travel}
+**Number of Travelers**: {number_of_travelers}  
+**Travel Dates**: {travel_dates}
+
+Could you please upload the passport of {passport_count} traveler(s) and provide hotel booking details if any?
+"""
+DETAILED_DEFAULTS = {
+    "country": "Not specified",
+    "purpose_of_travel": "Not specified",
+    "number_of_travelers": "Not specified",
+    "travel_dates": "Not specified"
+}
+
 def detailed_collector(state: State) -> dict:
     initial_info = state.get("initial_info", {})
-    
+
     # print("DEBUG: I'm in next node (detailed_collector)")
     # print(f"Collected initial_info: {json.dumps(initial_info, indent=2)}")
-    
-    message = f"""Here's what I collected from the initial information gathering:
 
-**Country**: {initial_info.get('country', 'Not specified')}
-**Purpose of Travel**: {initial_info.get('purpose_of_travel', 'Not specified')}
-**Number of Travelers**: {initial_info.get('number_of_travelers', 'Not specified')}  
-**Travel Dates**: {initial_info.get('travel_dates', 'Not specified')}
+    passport_count = {"passport_count": initial_info.get('number_of_travelers', 1)}
+    message = DETAILED_MESSAGE_TEMPLATE.format_map(ChainMap(passport_count, initial_info, DETAILED_DEFAULTS))
 
-Could you please upload the passport of {initial_info.get('number_of_travelers', 1)} traveler(s) and provide hotel booking details if any?
-"""
-    
-    return {"messages": [AIMessage(content=message)]}
\ No newline at end of file
+    return {"messages": [AIMessage(content=message)]}
@@ -1,53 +1,144 @@
-from state import State
+from state import State, latest_user_message
 from config.settings import llm
 from langchain_core.messages import AIMessage, HumanMessage
 from pydantic import BaseModel, Field
 from typing import Optional, List
+import asyncio
 import os
+import re
 import base64
-from openai import OpenAI
+import mmap
+import orjson
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 load_dotenv()
 
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it every image is sent in high detail
+    Image = None
+
 class DocumentInfo(BaseModel):
     document_type: str = Field(description="Type of document: passport, hotel_booking, bank_statement, etc.")
     content: dict = Field(description="Extracted information from the document")
-# Initialize OpenAI client  
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize OpenAI client (async, so several documents can be analysed concurrently)
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# System prompt for document analysis and classification
+DOCUMENT_ANALYSIS_PROMPT = """You are an expert OCR and document classification assistant. Analyze the provided document image and:
+
+1. **CLASSIFY DOCUMENT TYPE**: Determine if this is a:
+   - passport
+   - hotel_booking 
+   - bank_statement
+   - invoice
+   - receipt
+   - id_card
+   - other (specify type)
+
+2. **EXTRACT KEY INFORMATION**: Based on document type:
+
+For PASSPORT:
+- full_name
+- passport_number
+- nationality
+- date_of_birth (DD/MM/YYYY format)
+- issue_date (DD/MM/YYYY format)
+- expiry_date (DD/MM/YYYY format)
+- place_of_birth
+- issuing_authority
+
+For HOTEL_BOOKING:
+- hotel_name
+- guest_names
+- check_in_date (DD/MM/YYYY format)
+- check_out_date (DD/MM/YYYY format)
+- booking_reference
+- total_cost
+- room_type
+
+For OTHER documents:
+- Extract relevant key information based on document type
+
+3. **RESPONSE FORMAT**: Return JSON with:
+```json
+{
+  "document_type": "passport|hotel_booking|bank_statement|other",
+  "confidence": "high|medium|low",
+  "content": {
+    "key_field_1": "extracted_value",
+    "key_field_2": "extracted_value"
+  },
+  "summary": "Brief description of what was found"
+}
+```
+
+Be accurate and only extract information that is clearly visible."""
+
+# JSON schema for the analysis result; "content" stays open because its fields depend on the document type
+DOCUMENT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "document_info",
+        "strict": False,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "document_type": {"type": "string"},
+                "confidence": {"type": "string", "enum": ["high", "medium", "low"]},
+                "content": {"type": "object"},
+                "summary": {"type": "string"}
+            },
+            "required": ["document_type", "confidence", "content", "summary"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# File paths with a supported extension, and other slash-containing words (likely dates or other data);
+# quotes and commas around a word are not part of it
+FILE_PATH_PATTERN = re.compile(r"""[^\s"',]+\.(?:jpe?g|png|pdf)\b""", re.IGNORECASE)
+SLASHED_WORD_PATTERN = re.compile(r"""[^\s"',]*[\\/][^\s"',]*""")
+
+# Markdown code fence lines a model may wrap around JSON despite the response format
+CODE_FENCE_PATTERN = re.compile(r"^```(?:json)?[ \t]*$", re.MULTILINE | re.IGNORECASE)
+
+# Images whose longer side fits in a single 512px tile gain nothing from high detail
+LOW_DETAIL_MAX_SIDE = 512
 
 def encode_image(image_path: str) -> str:
-    """Encode image file to base64 string for OpenAI API"""
+    """Encode image file to base64 string for OpenAI API (memory-mapped, so the raw bytes are not copied)"""
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+        if os.fstat(image_file.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image_data:
+            return base64.b64encode(image_data).decode("ascii")
 
-def docs_parser(state: State) -> dict:
+def image_detail(image_path: str) -> str:
+    """OpenAI vision detail level: low for images small enough to be read at full size"""
+    if Image is None:
+        return "high"
+    try:
+        with Image.open(image_path) as image:
+            return "low" if max(image.size) <= LOW_DETAIL_MAX_SIDE else "high"
+    except Exception:
+        return "high"
+
+async def docs_parser(state: State) -> dict:
     """
     Generic document parser that can handle any document type.
     Extracts information and classifies document type automatically.
     """
     
     # Get the latest user message for file paths
-    user_message = ""
-    for msg in reversed(state["messages"]):
-        if hasattr(msg, 'type') and msg.type == 'human':
-            user_message = msg.content
-            break
-    
-    # Extract file paths from user message
-    potential_paths = []
-    non_file_slashes = []  # Track slash-containing words that aren't files
-    words = user_message.split()
+    user_message = latest_user_message(state)
     
-    for word in words:
-        # Only consider as file path if it has proper file extensions
-        if '.' in word and any(ext in word.lower() for ext in ['.jpg', '.jpeg', '.png', '.pdf']):
-            potential_paths.append(word.strip('",\''))
-        # Track slash-containing words without file extensions (likely dates or other data)
-        elif ('\\' in word or '/' in word) and word.strip('",\''):
-            non_file_slashes.append(word.strip('",\''))
+    # Extract file paths from user message (only words with proper file extensions)
+    potential_paths = FILE_PATH_PATTERN.findall(user_message)
     
     # Handle case where user provided slashes but no actual file paths
-    if not potential_paths and non_file_slashes:
+    non_file_slashes = SLASHED_WORD_PATTERN.findall(user_message) if not potential_paths else []
+    if non_file_slashes:
         return {
             "messages": [AIMessage(content=f"I see you mentioned '{', '.join(non_file_slashes)}' but these don't appear to be file paths. Please provide the full file paths to your documents with extensions like .jpg, .png, or .pdf (e.g., 'C:\\Documents\\passport.jpg').")]
         }
@@ -57,22 +148,22 @@ def docs_parser(state: State) -> dict:
             "messages": [AIMessage(content="Please provide your passport and hotel bookings if any.")]
         }
     
-    processed_documents = []
-    
+    # Verify every file exists before starting any OCR call
     for file_path in potential_paths:
-        # Verify file exists
         if not os.path.exists(file_path):
             return {
                 "messages": [AIMessage(content=f"File not found: {file_path}. Please check the path and try again.")]
             }
-        
-        try:
-            # Extract and classify document
-            doc_info = extract_document_info(file_path)
-            processed_documents.append(doc_info)
-        except Exception as e:
+    
+    # Extract and classify all documents concurrently
+    processed_documents = await asyncio.gather(
+        *(extract_document_info(file_path) for file_path in potential_paths),
+        return_exceptions=True
+    )
+    for file_path, doc_info in zip(potential_paths, processed_documents):
+        if isinstance(doc_info, Exception):
             return {
-                "messages": [AIMessage(content=f"Failed to process document {file_path}: {str(e)}")]
+                "messages": [AIMessage(content=f"Failed to process document {file_path}: {str(doc_info)}")]
             }
     
     # Route extracted information to appropriate state fields
@@ -91,70 +182,19 @@ def docs_parser(state: State) -> dict:
     
     return result
 
-def extract_document_info(file_path: str) -> dict:
+async def extract_document_info(file_path: str) -> dict:
     """
     Extract information from any document type using OpenAI's multimodal capabilities.
     """
     try:
-        # Encode image for OpenAI API
-        base64_image = encode_image(file_path)
+        # Encode image for OpenAI API (file read off the event loop)
+        base64_image = await asyncio.to_thread(encode_image, file_path)
         
-        # System prompt for document analysis and classification
-        system_prompt = """You are an expert OCR and document classification assistant. Analyze the provided document image and:
-
-1. **CLASSIFY DOCUMENT TYPE**: Determine if this is a:
-   - passport
-   - hotel_booking 
-   - bank_statement
-   - invoice
-   - receipt
-   - id_card
-   - other (specify type)
-
-2. **EXTRACT KEY INFORMATION**: Based on document type:
-
-For PASSPORT:
-- full_name
-- passport_number
-- nationality
-- date_of_birth (DD/MM/YYYY format)
-- issue_date (DD/MM/YYYY format)
-- expiry_date (DD/MM/YYYY format)
-- place_of_birth
-- issuing_authority
-
-For HOTEL_BOOKING:
-- hotel_name
-- guest_names
-- check_in_date (DD/MM/YYYY format)
-- check_out_date (DD/MM/YYYY format)
-- booking_reference
-- total_cost
-- room_type
-
-For OTHER documents:
-- Extract relevant key information based on document type
-
-3. **RESPONSE FORMAT**: Return JSON with:
-```json
-{
-  "document_type": "passport|hotel_booking|bank_statement|other",
-  "confidence": "high|medium|low",
-  "content": {
-    "key_field_1": "extracted_value",
-    "key_field_2": "extracted_value"
-  },
-  "summary": "Brief description of what was found"
-}
-```
-
-Be accurate and only extract information that is clearly visible."""
-
         # Make API call to OpenAI
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4o",
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": DOCUMENT_ANALYSIS_PROMPT},
                 {
                     "role": "user",
                     "content": [
@@ -163,24 +203,23 @@ Be accurate and only extract information that is clearly visible."""
                             "type": "image_url",
                             "image_url": {
                                 "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
+                                "detail": image_detail(file_path)
                             }
                         }
                     ]
                 }
             ],
             temperature=0.0,
-            response_format={"type": "json_object"}
+            response_format=DOCUMENT_RESPONSE_FORMAT
         )
         
         # Parse response with debug logging
-        import json
         content = response.choices[0].message.content
         
         if content is None:
             raise Exception(f"OpenAI returned empty response. Full response: {response}")
             
-        result = json.loads(content)
+        result = parse_document_json(content)
         
         # Add metadata
         result["file_path"] = file_path
@@ -198,6 +237,19 @@ Be accurate and only extract information that is clearly visible."""
             "error": str(e)
         }
 
+def parse_document_json(content: str) -> dict:
+    """Parse the model's JSON, salvaging output wrapped in code fences or surrounding text"""
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        pass
+    
+    content = CODE_FENCE_PATTERN.sub("", content).strip()
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"No JSON object in OpenAI response: {content[:200]}")
+    return orjson.loads(content[start:end + 1])
+
 def route_documents_to_state(documents: List[dict]) -> dict:
     """
     Route extracted document information to appropriate state fields.
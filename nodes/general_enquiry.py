@@ -1,63 +1,100 @@
+import logging
 import json
 import os
-from typing import Optional
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+import orjson
 from pydantic import BaseModel, Field
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.output_parsers import PydanticOutputParser
 from state import State
-from config.settings import llm
-import pprint
+from config.settings import llm, STREAM_TAG
+
+logger = logging.getLogger(__name__)
 
 class CountryExtraction(BaseModel):
     country: Optional[str] = Field(None, description="Extracted country name (lowercase, single word)")
     confidence: str = Field(description="High/Medium/Low confidence in extraction")
 
-class VisaResponse(BaseModel):
-    answer: str = Field(description="Direct answer to the visa question")
+# The parser and its format instructions depend only on the model class, so build them once
+COUNTRY_PARSER = PydanticOutputParser(pydantic_object=CountryExtraction)
+COUNTRY_FORMAT_INSTRUCTIONS = COUNTRY_PARSER.get_format_instructions()
 
-def extract_country_from_query(query: str) -> Optional[str]:
-    """Extract country name from user query using LLM"""
-    try:
-        parser = PydanticOutputParser(pydantic_object=CountryExtraction)
-        
-        extraction_prompt = f"""Extract the country name from this visa-related query. Return the country name in lowercase, single word format (e.g., 'vietnam', 'thailand', 'singapore').
+# Model for the streamed answer. It bypasses the global response cache: a cache hit returns the first
+# call's message with its id, so add_messages would replace the earlier reply instead of appending
+# (and a cached reply cannot stream tokens anyway)
+ANSWER_LLM = llm.model_copy(update={"cache": False})
 
-User Query: "{query}"
+# Static extraction instructions as a system message; only the query varies per call
+COUNTRY_EXTRACTION_SYSTEM_MESSAGE = SystemMessage(content=f"""Extract the country name from the user's visa-related query. Return the country name in lowercase, single word format (e.g., 'vietnam', 'thailand', 'singapore').
 
 If no specific country is mentioned, set country to null.
 
-{parser.get_format_instructions()}"""
-        
-        response = llm.invoke([HumanMessage(content=extraction_prompt)])
-        extracted = parser.parse(response.content)
+{COUNTRY_FORMAT_INSTRUCTIONS}""")
+
+# Same matching as agent_based_assistant/tools/visa_information.py (_known_country_pattern /
+# _match_known_country); the two apps are run separately and cannot share the module, so keep them in step
+@lru_cache(maxsize=1)
+def known_country_pattern() -> Optional["re.Pattern"]:
+    """Word-boundary regex over the countries present in the knowledge base (scanned once)"""
+    try:
+        countries = sorted(entry.name for entry in os.scandir("knowledge_base") if entry.is_dir())
+    except OSError:
+        return None
+    if not countries:
+        return None
+    return re.compile(r"\b(" + "|".join(map(re.escape, countries)) + r")\b", re.IGNORECASE)
+
+def match_known_country(query: str) -> Optional[str]:
+    """The single knowledge-base country named in the query, or None if none or several are named"""
+    pattern = known_country_pattern()
+    if pattern is None:
+        return None
+    mentioned = {match.lower() for match in pattern.findall(query)}
+    return mentioned.pop() if len(mentioned) == 1 else None
+
+def extract_country_from_query(query: str) -> Optional[str]:
+    """Extract country name from user query using LLM"""
+    try:
+        response = llm.invoke([COUNTRY_EXTRACTION_SYSTEM_MESSAGE, HumanMessage(content=f'User Query: "{query}"')])
+        extracted = COUNTRY_PARSER.parse(response.content)
         
         return extracted.country if extracted.confidence != "Low" else None
         
     except Exception as e:
-        print(f"Error extracting country: {e}")
+        logger.warning("Error extracting country: %s", e)
         return None
 
-def load_visa_knowledge(country: str) -> dict:
-    """Load visa information from JSON knowledge base"""
+def load_visa_knowledge(country: str) -> Tuple[dict, str]:
+    """Load visa information and its LLM context, re-read only when the JSON file changes"""
     if not country:
-        return {}
+        return {}, format_visa_info_for_llm({})
     
     knowledge_path = f"knowledge_base/{country}/visa_info.json"
-    if os.path.exists(knowledge_path):
-        try:
-            with open(knowledge_path, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-    return {}
+    try:
+        mtime = os.path.getmtime(knowledge_path)
+    except OSError:
+        return {}, format_visa_info_for_llm({})
+    return read_visa_knowledge(knowledge_path, mtime)
+
+@lru_cache(maxsize=64)
+def read_visa_knowledge(knowledge_path: str, mtime: float) -> Tuple[dict, str]:
+    """Parse and format one version of a knowledge file (mtime is part of the cache key)"""
+    try:
+        with open(knowledge_path, 'r') as f:
+            visa_info = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        visa_info = {}
+    return visa_info, format_visa_info_for_llm(visa_info)
 
 def format_visa_info_for_llm(visa_info: dict) -> str:
-    """Format entire visa information JSON for LLM context using pprint"""
+    """Format entire visa information JSON for LLM context"""
     if not visa_info:
         return "No specific visa information available."
     
-    # Use pprint to format the entire JSON in a readable way
-    formatted_json = pprint.pformat(visa_info, indent=2, width=100, depth=None)
+    # Indented JSON is readable for the LLM and uses fewer tokens than a pprint repr
+    formatted_json = orjson.dumps(visa_info, option=orjson.OPT_INDENT_2).decode()
     
     return f"COMPLETE VISA KNOWLEDGE BASE:\n{formatted_json}"
 
@@ -66,7 +103,8 @@ def general_enquiry(state: State) -> dict:
     try:
         user_message = state["messages"][-1].content
         
-        country = extract_country_from_query(user_message)
+        # Match a country we have knowledge for directly; only ask the LLM when that is ambiguous
+        country = match_known_country(user_message) or extract_country_from_query(user_message)
         
         # If no country extracted from query, check if we have ongoing visa application context
         if not country and state.get("collection_in_progress"):
@@ -74,24 +112,20 @@ def general_enquiry(state: State) -> dict:
             context_country = incomplete_info.get("country")
             if context_country:
                 country = context_country.lower()
-                print(f"Using context country: {country}")
+                logger.debug("Using context country: %s", country)
         
         if not country:
             return {
                 "messages": [AIMessage(content="I'd be happy to help with visa information! Could you please specify which country's visa you're asking about?")]
             }
         
-        visa_info = load_visa_knowledge(country)
+        visa_info, context = load_visa_knowledge(country)
         
         if not visa_info:
             return {
                 "messages": [AIMessage(content=f"I don't have detailed visa information for {country.title()} available at the moment. Please contact our support team for the most current information.")]
             }
         
-        context = format_visa_info_for_llm(visa_info)
-        
-        parser = PydanticOutputParser(pydantic_object=VisaResponse)
-        
         prompt = f"""You are a professional visa assistant. Answer the user's question based ONLY on the provided visa information context.
 
 CONTEXT:
@@ -124,13 +158,14 @@ This is an example - you need to provide customized responses like this for ever
 
 For any question related to visa, you need to answer like a Highly experienced Visa Assistant, with correct and appropriate short details.
 
-{parser.get_format_instructions()}"""
+Return ONLY the answer text, no JSON formatting."""
         
-        response = llm.invoke([HumanMessage(content=prompt)])
-        parsed_response = parser.parse(response.content)
+        # Plain-text answer tagged for streaming, so the user sees it as it is generated
+        response = ANSWER_LLM.invoke([HumanMessage(content=prompt)], config={"tags": [STREAM_TAG]})
         
+        # Keep the LLM message (and its id) so clients can match it to the streamed chunks
         result = {
-            "messages": [AIMessage(content=parsed_response.answer)]
+            "messages": [response.model_copy(update={"content": response.content.strip()})]
         }
         
         # If we came from visa collection flow, preserve context for routing back
@@ -142,7 +177,7 @@ For any question related to visa, you need to answer like a Highly experienced V
         return result
         
     except Exception as e:
-        print(f"Error in general_enquiry: {e}")
+        logger.error("Error in general_enquiry: %s", e)
         result = {
             "messages": [AIMessage(content="I'm having some technical difficulties right now. Please try your question again, or feel free to contact our support team for assistance.")]
         }
@@ -1,48 +1,104 @@
+import logging
+import re
+from functools import lru_cache
+from typing import Optional
 from state import State
 from config.settings import llm
 from utils.prompts import system_prompt, IntentClassification
-from langchain_core.messages import HumanMessage, AIMessage
+from nodes.base_information_collector import BASIC_FIELDS
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+logger = logging.getLogger(__name__)
+
+# Structured intent classifier, built once
+INTENT_LLM = llm.with_structured_output(IntentClassification)
+
+# Unambiguous messages routed without the classifier: a bare greeting, a document path,
+# or a first-person request to apply. Anything else goes to INTENT_LLM
+GREETING_PATTERN = re.compile(r"^\s*(hi|hello|hey|greetings|good (morning|afternoon|evening))( there)?[\s!.,]*$", re.IGNORECASE)
+DOCUMENT_PATH_PATTERN = re.compile(r"\S\.(?:jpe?g|png|pdf)\b", re.IGNORECASE)
+APPLY_PATTERN = re.compile(r"\b((i want to|i'?d like to|i would like to|help me|can i|let'?s) apply|start (my |a |the )?(visa )?application)\b", re.IGNORECASE)
+
+# Static answer-vs-enquiry instructions as a system message; only the question and reply vary per call
+RESPONSE_CLASSIFIER_SYSTEM_MESSAGE = SystemMessage(content="""You are given a question I asked the user and the user's response.
+
+TASK: Determine if the user is answering my question or asking something else entirely.
+
+EXAMPLES:
+- If I asked "What is your purpose of travel?" and user says "tourism" → ANSWER
+- If I asked "What is your purpose of travel?" and user says "what are land borders?" → GENERAL_ENQUIRY
+- If I asked "Which country?" and user says "Vietnam" → ANSWER
+- If I asked "Which country?" and user says "tell me visa requirements" → GENERAL_ENQUIRY
+
+Respond with only: "answer" or "general_enquiry"
+""")
+
+def quick_intent(user_message: str) -> Optional[str]:
+    """Route obvious messages locally; None means the LLM has to classify"""
+    if GREETING_PATTERN.match(user_message):
+        return "greetings"
+    if DOCUMENT_PATH_PATTERN.search(user_message):
+        return "docs_parser"
+    if APPLY_PATTERN.search(user_message):
+        return "visa_application"
+    return None
+
+# Replies to a pending collection question that settle the category without the LLM:
+# a bare number or purpose/yes-no word is an answer, a reply opening with a question word is an enquiry
+ANSWER_WORDS = frozenset({
+    "yes", "y", "no", "n", "ok", "okay",
+    "tourism", "tourist", "business", "work", "study", "student", "transit", "holiday", "vacation", "leisure"
+})
+NUMBER_PATTERN = re.compile(r"\d+")
+QUESTION_PATTERN = re.compile(r"(what|how|why|when|where|which|can|could|do|does|is|are|tell|explain)\b")
 
 def classify_user_response(assistant_question: str, user_message: str) -> str:
     """Use LLM to determine if user is answering our question or asking something else"""
+    # Case and whitespace do not change the category, so they are normalized out of the cache key
+    normalized_message = " ".join(user_message.lower().split())
+    if normalized_message in ANSWER_WORDS or NUMBER_PATTERN.fullmatch(normalized_message):
+        return "answer"
+    if QUESTION_PATTERN.match(normalized_message):
+        return "general_enquiry"
+    
     try:
-        classification_prompt = f"""
-        CONTEXT: I asked the user this question: "{assistant_question}"
-        
-        USER'S RESPONSE: "{user_message}"
-        
-        TASK: Determine if the user is answering my question or asking something else entirely.
-        
-        EXAMPLES:
-        - If I asked "What is your purpose of travel?" and user says "tourism" → ANSWER
-        - If I asked "What is your purpose of travel?" and user says "what are land borders?" → GENERAL_ENQUIRY
-        - If I asked "Which country?" and user says "Vietnam" → ANSWER  
-        - If I asked "Which country?" and user says "tell me visa requirements" → GENERAL_ENQUIRY
-        
-        Respond with only: "answer" or "general_enquiry"
-        """
-        
-        response = llm.invoke([HumanMessage(content=classification_prompt)])
-        result = response.content.strip().lower()
-        
-        if "answer" in result:
-            return "answer"
-        elif "general_enquiry" in result or "general" in result:
-            return "general_enquiry"
-        else:
-            return "answer"  # Default fallback
-            
+        return classify_normalized_response(assistant_question, normalized_message)
     except Exception as e:
-        print(f"Error in classify_user_response: {e}")
+        logger.warning("Error in classify_user_response: %s", e)
         return "answer"  # Safe fallback
 
+@lru_cache(maxsize=4096)
+def classify_normalized_response(assistant_question: str, user_message: str) -> str:
+    """
+    LLM classification of a normalized reply, memoized per (question, reply).
+    Failures raise and are not cached; cache_info() reports hits and misses.
+    """
+    response = llm.invoke([
+        RESPONSE_CLASSIFIER_SYSTEM_MESSAGE,
+        HumanMessage(content=f'CONTEXT: I asked the user this question: "{assistant_question}"\n\nUSER\'S RESPONSE: "{user_message}"')
+    ])
+    result = response.content.strip().lower()
+    
+    if "answer" in result:
+        return "answer"
+    elif "general_enquiry" in result or "general" in result:
+        return "general_enquiry"
+    else:
+        return "answer"  # Default fallback
+
+@lru_cache(maxsize=8192)
+def classify_intent(user_message: str) -> IntentClassification:
+    """Intent (and, for visa_application, basic fields) of a whitespace-normalized message; failures raise and are not cached"""
+    return INTENT_LLM.invoke([system_prompt, HumanMessage(content=user_message)])
+
 def intent_analyser(state:State) -> dict:
     user_message = state["messages"][-1].content
     
     # Handle empty or whitespace-only messages - just respond and wait for next input
     if not user_message or not user_message.strip():
         return {
-            "messages": [AIMessage(content="Hey, you haven't entered anything! Please provide your question or let me know how I can help you with your visa needs.")]
+            "messages": [AIMessage(content="Hey, you haven't entered anything! Please provide your question or let me know how I can help you with your visa needs.")],
+            "next": "__end__"  # End the turn here; a stale "next" would route the empty message on
         }
     
     # If we're awaiting user response, analyze if user is answering or asking something else
@@ -51,7 +107,7 @@ def intent_analyser(state:State) -> dict:
             # Get the last assistant message (our pending question)
             assistant_question = ""
             for msg in reversed(state["messages"][:-1]):  # Exclude current user message
-                if hasattr(msg, 'type') and msg.type == 'ai':
+                if isinstance(msg, AIMessage):
                     assistant_question = msg.content
                     break
             
@@ -76,29 +132,40 @@ def intent_analyser(state:State) -> dict:
                 return {"next": "base_information_collector", "user_answer_category": "answer"}
                 
         except Exception as e:
-            print(f"Context switching analysis error: {e}")
+            logger.warning("Context switching analysis error: %s", e)
             # Fallback to continuing collection
             return {"next": "base_information_collector"}
     
     if state.get("incomplete_session_id") and user_message.lower().strip() in ["yes", "y", "no", "n", "continue", "proceed", "start over"]:
         return {"next": "handle_resume_decision"}
     
+    next_node = quick_intent(user_message)
+    if next_node:
+        return {"next": next_node}
+    
     try:
-        # Use structured output with your detailed prompt
-        structured_llm = llm.with_structured_output(IntentClassification)
-        result = structured_llm.invoke([system_prompt, HumanMessage(content=user_message)])
+        # Use structured output with your detailed prompt (memoized per whitespace-normalized message).
+        # Case is kept: the same call extracts country and dates, which must not come back lowercased
+        classification = classify_intent(" ".join(user_message.split()))
+        user_intent = classification.user_intent
         
         # Route based on classified intent
-        if result.user_intent == "greetings":
+        if user_intent == "greetings":
             return {"next": "greetings"}
-        elif result.user_intent == "general_enquiry":
+        elif user_intent == "general_enquiry":
             return {"next": "general_enquiry"}
-        elif result.user_intent == "document_submission":
+        elif user_intent == "document_submission":
             return {"next": "docs_parser"}
         else:  # visa_application
-            return {"next": "visa_application"}
+            # Fields were extracted in the same call; base_information_collector skips its own extraction
+            diff = {field: value for field, value in classification.model_dump(include=set(BASIC_FIELDS), exclude_none=True).items() if value}
+            return {
+                "next": "visa_application",
+                "initial_info": {**(state.get("initial_info") or {}), **diff},
+                "intent_extracted_message": user_message
+            }
             
     except Exception as e:
-        print(f"Intent classification error: {e}")
+        logger.warning("Intent classification error: %s", e)
         # Safe fallback to general enquiry
         return {"next": "general_enquiry"}
@@ -1,9 +1,10 @@
-from state import State
+from state import State, latest_user_message
 from config.settings import llm
 from langchain_core.messages import AIMessage
 from pydantic import BaseModel, Field
 from typing import Optional
 import os
+import re
 from pathlib import Path
 
 class PassportInfo(BaseModel):
@@ -16,6 +17,11 @@ class PassportInfo(BaseModel):
     expiry_date: Optional[str] = Field(None, description="Passport expiry date (DD/MM/YYYY)")
     issuing_authority: Optional[str] = Field(None, description="Issuing authority")
 
+# Messages mentioning any of these (as substrings, case-insensitive) are treated as file submissions
+FILE_KEYWORD_PATTERN = re.compile(r"file|path|upload|passport", re.IGNORECASE)
+# Words with an image/PDF extension or a path separator; surrounding quotes and commas are excluded
+PASSPORT_PATH_PATTERN = re.compile(r"""[^\s"',]+\.(?:jpe?g|png|pdf)\b|[^\s"',]*[\\/][^\s"',]*""", re.IGNORECASE)
+
 def extract_passport_info(file_path: str, traveler_index: int) -> dict:
     """
     Extract passport information from image file using OCR.
@@ -50,25 +56,16 @@ def passport_processor(state: State) -> dict:
     """
     
     # Get the latest user message for file paths
-    user_message = ""
-    for msg in reversed(state["messages"]):
-        if hasattr(msg, 'type') and msg.type == 'human':
-            user_message = msg.content
-            break
+    user_message = latest_user_message(state)
     
     # Check if user provided file paths
-    if not user_message or not any(keyword in user_message.lower() for keyword in ['file', 'path', 'upload', 'passport']):
+    if not user_message or not FILE_KEYWORD_PATTERN.search(user_message):
         return {
             "messages": [AIMessage(content="Please provide the file path(s) to your passport images. Example: C:\\Documents\\passport1.jpg")]
         }
     
     # Extract file paths from user message
-    # This is a simple implementation - could be enhanced with regex
-    potential_paths = []
-    words = user_message.split()
-    for word in words:
-        if ('.' in word and any(ext in word.lower() for ext in ['.jpg', '.jpeg', '.png', '.pdf'])) or ('\\' in word or '/' in word):
-            potential_paths.append(word.strip('",\''))
+    potential_paths = PASSPORT_PATH_PATTERN.findall(user_message)
     
     if not potential_paths:
         return {
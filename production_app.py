@@ -1,13 +1,31 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from langchain_core.messages import AIMessage, HumanMessage
 from contextlib import asynccontextmanager
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from psycopg_pool import AsyncConnectionPool
 from pydantic import BaseModel
 from typing import List, Dict, Any
+import logging
+import orjson
 import os
+import time
 import uuid
 from graph.builder import build_graph
+from config.settings import STREAM_TAG
+
+logger = logging.getLogger(__name__)
+
+def sse_event(payload: Dict[str, Any]) -> bytes:
+    """Encode one server-sent event (orjson serializes straight to bytes)"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 version 7): 48-bit millisecond timestamp followed by random bits"""
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = value & ~(0xF << 76) | (0x7 << 76)  # version 7
+    value = value & ~(0x3 << 62) | (0x2 << 62)  # RFC variant
+    return uuid.UUID(int=value)
 
 # Global connection pool
 connection_pool = None
@@ -24,24 +42,36 @@ async def lifespan(app: FastAPI):
     # For local testing, skip PostgreSQL and use memory checkpointer
     if os.getenv("ENVIRONMENT") == "production":
         try:
-            connection_pool = AsyncConnectionPool(conninfo=database_uri)
+            # Bounded pool; autocommit is required by the checkpointer's setup() migrations, and
+            # statements repeated by the checkpointer are prepared server-side. Behind PgBouncer in
+            # transaction mode prepared statements cannot be shared, so set PGBOUNCER to disable them
+            connection_pool = AsyncConnectionPool(
+                conninfo=database_uri,
+                min_size=int(os.getenv("DB_POOL_MIN_SIZE", 4)),
+                max_size=int(os.getenv("DB_POOL_MAX_SIZE", 20)),
+                timeout=10,
+                kwargs={
+                    "autocommit": True,
+                    "prepare_threshold": None if os.getenv("PGBOUNCER") else 5
+                }
+            )
             checkpointer = AsyncPostgresSaver(connection_pool)
             await checkpointer.setup()
             
             # Build graph with PostgreSQL checkpointer
             compiled_graph = build_graph(checkpointer=checkpointer)
             
-            print("✅ LangGraph production server initialized with PostgreSQL")
+            logger.info("LangGraph production server initialized with PostgreSQL")
             
         except Exception as e:
-            print(f"❌ Failed to initialize PostgreSQL: {e}")
+            logger.error("Failed to initialize PostgreSQL: %s", e)
             raise e
     else:
         # Local development - use memory checkpointer
         from langgraph.checkpoint.memory import MemorySaver
         checkpointer = MemorySaver()
         compiled_graph = build_graph(checkpointer=checkpointer)
-        print("⚠️ Using memory checkpointer for local development")
+        logger.warning("Using memory checkpointer for local development")
     
     yield
     
@@ -93,12 +123,10 @@ async def get_assistant(assistant_id: str):
 
 @app.post("/threads", response_model=ThreadResponse)
 async def create_thread():
-    thread_id = str(uuid.uuid4())
+    # Time-ordered ids keep new checkpoint rows close together in the thread_id index
+    thread_id = str(uuid7())
     return ThreadResponse(thread_id=thread_id)
 
-# Store message counts per thread to track new messages
-thread_message_counts = {}
-
 @app.post("/threads/{thread_id}/runs/wait", response_model=RunResponse)
 async def run_thread(thread_id: str, request: MessageRequest):
     if not compiled_graph:
@@ -115,39 +143,38 @@ async def run_thread(thread_id: str, request: MessageRequest):
             }
         }
         
-        # Get current message count before running
-        current_state = await compiled_graph.aget_state(config)
-        messages_before = 0
-        if current_state and current_state.values and "messages" in current_state.values:
-            messages_before = len(current_state.values["messages"])
+        # Give the input message a known id so the reply can be located in the returned
+        # state, without reading the checkpoint before and after the run
+        input_message = HumanMessage(content=user_message, id=str(uuid.uuid4()))
         
         # Run the graph with persistent state
         result = await compiled_graph.ainvoke(
-            {"messages": [{"role": "human", "content": user_message}]},
+            {"messages": [input_message]},
             config=config
         )
         
-        # Get messages after running
-        new_state = await compiled_graph.aget_state(config)
-        response_messages = []
+        # Get only the NEW messages (after our input message)
+        new_messages = []
+        for msg in reversed(result.get("messages", [])):
+            if msg.id == input_message.id:
+                break
+            new_messages.append(msg)
+        else:
+            new_messages = []  # Input not found: never echo the whole history
+        new_messages.reverse()
         
-        if new_state and new_state.values and "messages" in new_state.values:
-            all_messages = new_state.values["messages"]
-            # Get only the NEW AI messages (after the previous count)
-            new_messages = all_messages[messages_before:]
-            
-            for msg in new_messages:
-                if hasattr(msg, 'content') and hasattr(msg, 'type'):
-                    if msg.type == 'ai':  # Include ALL new AI messages
-                        response_messages.append({
-                            "role": "assistant", 
-                            "content": msg.content
-                        })
+        response_messages = []
+        for msg in new_messages:
+            if isinstance(msg, AIMessage):  # Include ALL new AI messages
+                response_messages.append({
+                    "role": "assistant", 
+                    "content": msg.content
+                })
         
         return RunResponse(messages=response_messages)
         
     except Exception as e:
-        print(f"❌ Error in run_thread: {e}")
+        logger.error("Error in run_thread: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/threads/{thread_id}/state")
@@ -166,7 +193,6 @@ async def get_thread_state(thread_id: str):
 @app.post("/threads/{thread_id}/runs/stream")
 async def stream_run(thread_id: str, request: dict):
     from fastapi.responses import StreamingResponse
-    import json
     
     try:
         # Get the input messages
@@ -186,7 +212,7 @@ async def stream_run(thread_id: str, request: dict):
         }
         
         async def generate_stream():
-            print(f"Starting stream for thread {thread_id}, message: {user_message}")
+            logger.debug("Starting stream for thread %s, message: %r", thread_id, user_message)
             
             # First, yield the user message in LangGraph format
             user_message_obj = {
@@ -195,32 +221,41 @@ async def stream_run(thread_id: str, request: dict):
                 "content": user_message,
                 "created_at": "2025-01-01T00:00:00Z"
             }
-            yield f"data: {json.dumps(user_message_obj)}\n\n"
+            yield sse_event(user_message_obj)
             
-            # Stream the AI response
-            async for chunk in compiled_graph.astream(
+            # Stream the AI response: tokens of user-facing LLM calls are forwarded as they
+            # arrive, and every AI message is sent whole once its node finishes. Streaming nodes
+            # return the LLM's own message, so its final event carries the same id as its chunks
+            async for mode, payload in compiled_graph.astream(
                 {"messages": [{"role": "human", "content": user_message}]},
-                config=config
+                config=config,
+                stream_mode=["messages", "updates"]
             ):
-                print(f"Stream chunk: {chunk}")
-                # Look for messages in the chunk values
-                for node_name, node_data in chunk.items():
+                if mode == "messages":
+                    chunk, metadata = payload
+                    if STREAM_TAG in metadata.get("tags", ()) and isinstance(chunk.content, str) and chunk.content:
+                        ai_chunk_obj = {
+                            "id": f"ai_{thread_id}_{chunk.id}",
+                            "type": "ai_chunk",
+                            "content": chunk.content
+                        }
+                        yield sse_event(ai_chunk_obj)
+                    continue
+                
+                # Look for messages in the node updates
+                for node_name, node_data in payload.items():
                     if node_data and isinstance(node_data, dict) and "messages" in node_data:
-                        print(f"Found messages in {node_name}: {node_data['messages']}")
                         for msg in node_data["messages"]:
-                            if hasattr(msg, 'content') and hasattr(msg, 'type'):
-                                print(f"Message type: {msg.type}, content: {msg.content}")
-                                if msg.type == 'ai':
-                                    ai_message_obj = {
-                                        "id": f"ai_{thread_id}_{msg.id}",
-                                        "type": "ai", 
-                                        "content": msg.content,
-                                        "created_at": "2025-01-01T00:00:00Z"
-                                    }
-                                    print(f"Yielding AI message: {msg.content}")
-                                    yield f"data: {json.dumps(ai_message_obj)}\n\n"
+                            if isinstance(msg, AIMessage):
+                                ai_message_obj = {
+                                    "id": f"ai_{thread_id}_{msg.id}",
+                                    "type": "ai", 
+                                    "content": msg.content,
+                                    "created_at": "2025-01-01T00:00:00Z"
+                                }
+                                yield sse_event(ai_message_obj)
             
-            print("Stream completed")
+            logger.debug("Stream completed for thread %s", thread_id)
         
         return StreamingResponse(
             generate_stream(),
@@ -232,7 +267,7 @@ async def stream_run(thread_id: str, request: dict):
         )
         
     except Exception as e:
-        print(f"Error in stream_run: {e}")
+        logger.error("Error in stream_run: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Temporarily disabled debug endpoint
@@ -251,5 +286,6 @@ if __name__ == "__main__":
     if sys.platform == "win32":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
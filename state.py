@@ -2,6 +2,7 @@ from typing import Annotated, Any, Optional
 from typing_extensions import TypedDict
 from langgraph.graph.message import add_messages
 from operator import add
+from langchain_core.messages import HumanMessage
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
@@ -25,3 +26,21 @@ class State(TypedDict):
     missing_fields: Optional[list[str]]
     awaiting_user_response: Optional[bool]                     # True when waiting for user to provide missing info
     extraction_retry_count: Optional[int]                      # Counter to prevent infinite retry loops
+    intent_extracted_message: Optional[str]                    # User message whose basic fields intent_analyser already extracted
+    last_human_idx: Optional[int]                              # Index of the latest user message in messages (set by main.py)
+
+
+def latest_user_message(state: State) -> str:
+    """Content of the latest user message, read via last_human_idx when it is set"""
+    messages = state["messages"]
+    index = state.get("last_human_idx")
+    if index is not None and 0 <= index < len(messages):
+        msg = messages[index]
+        if isinstance(msg, HumanMessage):
+            return msg.content
+    
+    # Fall back to scanning (e.g. when invoked without main.py)
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage):
+            return msg.content
+    return ""
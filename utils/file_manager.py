@@ -1,47 +1,77 @@
-import json
+import asyncio
 import os
+import orjson
 import uuid
 from datetime import datetime
 from state import State
 
+INCOMPLETE_APPLICATIONS_DIR = "incomplete_applications"
+
+# State categories saved with an incomplete application, in file order
+COLLECTED_DATA_KEYS = (
+    "travel_details", "visa_details", "personal_info", "passport_info", "employment_info",
+    "financial_info", "accommodation_info", "document_uploads", "emergency_contacts", "insurance_info"
+)
+
+def session_filename(session_id: str) -> str:
+    return f"{INCOMPLETE_APPLICATIONS_DIR}/session_{session_id}.json"
+
 def save_incomplete_application(state: State) -> str:
-    session_id = str(uuid.uuid4())[:8]
+    session_id = uuid.uuid4().hex[:8]
     
     incomplete_data = {
         "session_id": session_id,
         "timestamp": datetime.now().isoformat(),
-        "collected_data": {
-            "travel_details": state.get("travel_details", []),
-            "visa_details": state.get("visa_details", []),
-            "personal_info": state.get("personal_info", []),
-            "passport_info": state.get("passport_info", []),
-            "employment_info": state.get("employment_info", []),
-            "financial_info": state.get("financial_info", []),
-            "accommodation_info": state.get("accommodation_info", []),
-            "document_uploads": state.get("document_uploads", []),
-            "emergency_contacts": state.get("emergency_contacts", []),
-            "insurance_info": state.get("insurance_info", [])
-        },
+        # Only populated categories are written; loading restores the rest as empty lists
+        "collected_data": {key: value for key in COLLECTED_DATA_KEYS if (value := state.get(key))},
         "missing_fields": state.get("missing_fields", [])
     }
     
-    os.makedirs("incomplete_applications", exist_ok=True)
-    
-    filename = f"incomplete_applications/session_{session_id}.json"
-    with open(filename, 'w') as f:
-        json.dump(incomplete_data, f, indent=2)
+    # Write to a temporary file, flush it to disk and rename it into place, so readers never see
+    # a partial file and a crash cannot leave an empty one behind
+    filename = session_filename(session_id)
+    temp_filename = f"{filename}.tmp"
+    try:
+        f = open(temp_filename, 'wb')
+    except FileNotFoundError:
+        # Only the first save creates the directory, instead of a mkdir call on every save
+        os.makedirs(INCOMPLETE_APPLICATIONS_DIR, exist_ok=True)
+        f = open(temp_filename, 'wb')
+    with f:
+        f.write(orjson.dumps(incomplete_data, option=orjson.OPT_NON_STR_KEYS))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
     
     return session_id
 
 def load_incomplete_application(session_id: str) -> dict:
-    filename = f"incomplete_applications/session_{session_id}.json"
+    filename = session_filename(session_id)
     
-    if os.path.exists(filename):
-        with open(filename, 'r') as f:
-            return json.load(f)
-    return {}
+    try:
+        with open(filename, 'rb') as f:
+            data = orjson.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    
+    collected_data = data.setdefault("collected_data", {})
+    for key in COLLECTED_DATA_KEYS:
+        collected_data.setdefault(key, [])
+    return data
 
 def delete_incomplete_application(session_id: str):
-    filename = f"incomplete_applications/session_{session_id}.json"
-    if os.path.exists(filename):
+    filename = session_filename(session_id)
+    try:
         os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+# Async variants for graph nodes: the file I/O runs in a worker thread instead of on the event loop
+async def asave_incomplete_application(state: State) -> str:
+    return await asyncio.to_thread(save_incomplete_application, state)
+
+async def aload_incomplete_application(session_id: str) -> dict:
+    return await asyncio.to_thread(load_incomplete_application, session_id)
+
+async def adelete_incomplete_application(session_id: str):
+    await asyncio.to_thread(delete_incomplete_application, session_id)
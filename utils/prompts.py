@@ -1,8 +1,10 @@
 from langchain_core.messages import SystemMessage
-from pydantic import BaseModel, Field
-from typing import Literal
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Literal, Optional
 
-system_prompt = SystemMessage(content="""
+# Intent classification instructions. Sent as a cache-marked block so the provider can reuse the
+# already-processed prefix (tool schema + this prompt) instead of re-reading it on every request
+system_prompt = SystemMessage(content=[{"type": "text", "cache_control": {"type": "ephemeral"}, "text": """
     You are a classification assistant. Analyze the user message and determine if it's:
     1. "greetings" - Hi, Hello or Greetings - Just a greeting message,
     2. "general_enquiry" - Questions about visa information, requirements, processing times.
@@ -42,13 +44,25 @@ system_prompt = SystemMessage(content="""
     - general_enquiry 
     - visa_application
     - document_submission
-    """)
+    
+    For visa_application only, also extract the basic trip details if (and only if) they are explicitly
+    mentioned: country, purpose_of_travel, number_of_travelers, travel_dates. Leave the rest null.
+    """}])
 
 class IntentClassification(BaseModel):
     """
     Represents user intent classification for visa agent routing.
+    For visa_application it also carries the basic fields mentioned in the same message,
+    so base_information_collector does not need a second LLM call on it.
     """
+    # Results are memoized and shared, so they must not be modified
+    model_config = ConfigDict(frozen=True)
+    
     user_intent: Literal["greetings", "general_enquiry", "visa_application", "document_submission"] = Field(
         ..., description="The classified intent of the user message"
     )
     confidence: float = Field(..., description="Confidence score between 0.0 and 1.0")
+    country: Optional[str] = Field(None, description="visa_application only: country name (capitalized)")
+    purpose_of_travel: Optional[str] = Field(None, description="visa_application only: purpose of travel (e.g., tourism, business, work, study, transit)")
+    number_of_travelers: Optional[int] = Field(None, description="visa_application only: number of travelers as integer ('solo trip' = 1, 'me and my wife' = 2)")
+    travel_dates: Optional[str] = Field(None, description="visa_application only: travel dates from and to in DD/MM/YY format ('24 Jan to 3rd Feb 2026' → '24/01/26 to 03/02/26'); keep the original if it cannot be converted")